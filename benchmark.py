@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import rumprof.render
+from rumprof import (
+    step_mapping, time_fmt, find_log_files, parse_log_file,
+    scan_log_file, concat_events, procs_from_events, procs_to_array,
+    merge_copies, make_final_table, print_tables)
+
+# Steps the generator writes to the chunk logs and to the
+# post-processing log. They are taken from step_mapping, so renaming
+# and combining steps is exercised too.
+postproc_targets = set(['Other post-processing', 'Sort junctions'])
+chunk_steps   = sorted(s for s in step_mapping
+                       if step_mapping[s] not in postproc_targets)
+postproc_steps = sorted(s for s in step_mapping
+                        if step_mapping[s] in postproc_targets)
+
+default_baseline = 'benchmark_baseline.json'
+
+# Differences smaller than this are timer noise, and aren't reported as
+# regressions however large they are relative to the baseline
+min_regression_seconds = 0.01
+
+def log_line(t, message, level='INFO', logger='RUM.Workflow'):
+    return '%s node42 %d %s %s - %s\n' % (
+        time.strftime(time_fmt, time.localtime(t)), 4242, level, logger,
+        message)
+
+def step_lines(rng, t, steps, noise, max_seconds):
+
+    """Return the lines for running the given steps one after another
+starting at time t, with up to noise lines of chatter after each
+event, along with the time the last step finished."""
+
+    lines = []
+    for step in steps:
+        lines.append(log_line(t, 'START ' + step))
+        for i in range(rng.randint(0, noise)):
+            lines.append(log_line(t, 'Processed %d reads' % rng.randint(0, 10**6),
+                                  'DEBUG', 'RUM.Script'))
+        t += rng.randint(10, max_seconds)
+        lines.append(log_line(t, 'FINISH ' + step))
+        for i in range(rng.randint(0, noise)):
+            lines.append(log_line(t, 'Wrote %d alignments' % rng.randint(0, 10**6),
+                                  'DEBUG', 'RUM.Script'))
+    return (lines, t)
+
+def generate_job(path, chunks, steps, noise, seed, start=1349000000):
+
+    """Write a synthetic log directory for one RUM job under path, with
+one rum_N.log per chunk running the first steps of chunk_steps, a
+rum.log, and a rum_postproc.log. Returns the number of lines written."""
+
+    rng = random.Random(seed)
+    log_dir = os.path.join(path, 'log')
+    os.makedirs(log_dir)
+
+    # More steps than step_mapping has get made-up names that aren't
+    # renamed
+    names = chunk_steps[:steps] + ['Extra step %d' % i
+                                   for i in range(steps - len(chunk_steps))]
+    num_lines = 0
+
+    with open(os.path.join(log_dir, 'rum.log'), 'w') as f:
+        f.write(log_line(start, 'Starting job', logger='RUM.Main'))
+        num_lines += 1
+
+    end = start
+    for chunk in range(1, chunks + 1):
+        t = start + 600 + rng.randint(0, 30)
+        first = log_line(t, 'Starting chunk %d' % chunk, logger='RUM.Main')
+        (lines, t) = step_lines(rng, t, names, noise, 3000)
+        with open(os.path.join(log_dir, 'rum_%d.log' % chunk), 'w') as f:
+            f.write(first)
+            f.writelines(lines)
+        num_lines += len(lines) + 1
+        end = max(end, t)
+
+    (lines, t) = step_lines(rng, end + 5, postproc_steps, noise, 600)
+    with open(os.path.join(log_dir, 'rum_postproc.log'), 'w') as f:
+        f.write(log_line(end + 5, 'Starting post-processing',
+                         logger='RUM.Main'))
+        f.writelines(lines)
+    num_lines += len(lines) + 1
+
+    return num_lines
+
+def generate(root, jobs, copies, chunks, steps, noise, seed):
+
+    """Write copies copies of each of jobs synthetic jobs under root, as
+root/jobN/copyM. Returns a list of (job_name, dir) pairs and the total
+number of log lines."""
+
+    result = []
+    num_lines = 0
+    for j in range(jobs):
+        for c in range(copies):
+            path = os.path.join(root, 'job%d' % j, 'copy%d' % c)
+            num_lines += generate_job(path, chunks, steps, noise,
+                                      seed + j * copies + c)
+            result.append(('job%d' % j, path))
+    return (result, num_lines)
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def time_stage(repeat, func):
+
+    """Call func repeat times and return its last result and the fastest
+time it took. Anything it prints is thrown away."""
+
+    best = None
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for i in range(repeat):
+            start = time.time()
+            result = func()
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return (result, best)
+
+def run_benchmark(jobs, num_lines, repeat, out_dir):
+
+    """Run each stage of the profile_jobs.py pipeline on the given
+(job_name, dir) pairs and return a list of (stage, seconds, items,
+unit, peak MB) tuples."""
+
+    results = []
+
+    def record(stage, func, items, unit):
+        (result, seconds) = time_stage(repeat, func)
+        results.append((stage, seconds, items, unit, peak_mb()))
+        return result
+
+    # Startup time: what every run of profile_jobs.py pays before doing
+    # any work, measured as the time for --help in a new interpreter
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.devnull, 'w') as devnull:
+        record('startup', lambda: subprocess.check_call(
+                [sys.executable, 'profile_jobs.py', '--help'], cwd=here,
+                stdout=devnull), 1, 'runs')
+
+    log_files = [(name, find_log_files(path)) for (name, path) in jobs]
+
+    def parse_with(parser):
+        return [concat_events([parser(f, name) for f in files])
+                for (name, files) in log_files]
+
+    record('parse_log_file', lambda: parse_with(parse_log_file),
+           num_lines, 'lines')
+    job_events = record('scan_log_file', lambda: parse_with(scan_log_file),
+                        num_lines, 'lines')
+    num_events = sum(len(events) for events in job_events)
+
+    job_procs = record('build_timings',
+                       lambda: [procs_from_events(events)
+                                for events in job_events],
+                       num_events, 'events')
+    num_procs = sum(len(procs) for procs in job_procs)
+
+    copies = record('procs_to_array',
+                    lambda: [procs_to_array(procs) for procs in job_procs],
+                    num_procs, 'procs')
+
+    stats = {}
+    for ((name, path), table) in zip(jobs, copies):
+        stats.setdefault(name, []).append(table)
+    names = sorted(stats)
+
+    tables = record('merge_copies',
+                    lambda: [(name, merge_copies(stats[name]))
+                             for name in names],
+                    len(copies), 'copies')
+
+    table = record('make_final_table', lambda: make_final_table(tables),
+                   len(tables) * len(tables[0][1]), 'cells')
+
+    rumprof.render.output_dir = out_dir
+    record('print_table',
+           lambda: print_tables(table, names, ['cpu', 'wc']),
+           2 * len(table), 'rows')
+
+    return results
+
+def compare(results, baseline, tolerance):
+
+    """Return a list with the baseline time for each stage in results
+and whether it is more than tolerance slower than the baseline, or
+(None, False) for stages missing from the baseline."""
+
+    comparison = []
+    for (stage, seconds, items, unit, peak) in results:
+        if stage in baseline:
+            before = baseline[stage]['seconds']
+            slower = (seconds > before * (1 + tolerance) and
+                      seconds - before > min_regression_seconds)
+            comparison.append((before, slower))
+        else:
+            comparison.append((None, False))
+    return comparison
+
+def print_results(results, comparison, out=sys.stdout):
+    out.write('%-18s %10s %20s %10s %10s %8s\n' % (
+            'stage', 'seconds', 'throughput', 'peak MB', 'baseline',
+            'change'))
+    for ((stage, seconds, items, unit, peak), (before, slower)) in zip(
+        results, comparison):
+        rate = '%d %s/s' % (items / seconds, unit) if seconds > 0 else '-'
+        if before is None:
+            change = ('-', '-', '')
+        else:
+            change = ('%.3f' % before,
+                      '%+.1f%%' % (100.0 * (seconds - before) / before),
+                      '  SLOWER' if slower else '')
+        out.write('%-18s %10.3f %20s %10.1f %10s %8s%s\n' % (
+                (stage, seconds, rate, peak) + change))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="""Time each stage of profile_jobs.py on synthetic
+        RUM logs""")
+    commands = parser.add_subparsers(dest='command')
+
+    generate = commands.add_parser(
+        'generate', help="Write synthetic job log directories")
+    generate.add_argument(
+        'dir', help="Directory to write the jobs to, as DIR/jobN/copyM")
+
+    run = commands.add_parser(
+        'run', help="Generate jobs in a temporary directory and time each stage")
+    run.add_argument(
+        '--repeat', type=int, default=3, metavar='N',
+        help="Run each stage N times and report the fastest (default %(default)s)")
+    run.add_argument(
+        '--baseline', default=default_baseline, metavar='FILE',
+        help="""Results to compare against, if the file exists (default
+        %(default)s)""")
+    run.add_argument(
+        '--save', action='store_true',
+        help="Save the results as the new baseline")
+    run.add_argument(
+        '--tolerance', type=float, default=0.2, metavar='F',
+        help="""Flag stages more than F times slower than the baseline,
+        and exit with status 1 if there are any (default %(default)s)""")
+
+    for command in (generate, run):
+        command.add_argument(
+            '--jobs', type=int, default=2, metavar='N',
+            help="Number of jobs (default %(default)s)")
+        command.add_argument(
+            '--copies', type=int, default=3, metavar='N',
+            help="Number of copies of each job (default %(default)s)")
+        command.add_argument(
+            '--chunks', type=int, default=32, metavar='N',
+            help="Number of chunks per job (default %(default)s)")
+        command.add_argument(
+            '--steps', type=int, default=len(chunk_steps), metavar='N',
+            help="Number of steps each chunk runs (default %(default)s)")
+        command.add_argument(
+            '--noise', type=int, default=100, metavar='N',
+            help="""Up to N lines that aren't workflow events after each
+            event (default %(default)s)""")
+        command.add_argument(
+            '--seed', type=int, default=1,
+            help="Random seed (default %(default)s)")
+
+    return parser.parse_args(argv)
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+    params = dict((name, getattr(args, name)) for name in
+                  ('jobs', 'copies', 'chunks', 'steps', 'noise', 'seed'))
+
+    if args.command == 'generate':
+        (jobs, num_lines) = generate(args.dir, **params)
+        print "Wrote %d jobs, %d log lines" % (len(jobs), num_lines)
+        return
+
+    tmp = tempfile.mkdtemp(prefix='rum_benchmark')
+    try:
+        (jobs, num_lines) = generate(os.path.join(tmp, 'jobs'), **params)
+        out_dir = os.path.join(tmp, 'out')
+        os.mkdir(out_dir)
+        results = run_benchmark(jobs, num_lines, args.repeat, out_dir)
+    finally:
+        shutil.rmtree(tmp)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved['params'] != params:
+            print "Not comparing to %s, which used different parameters: %s" % (
+                args.baseline, saved['params'])
+        else:
+            baseline = saved['stages']
+
+    comparison = compare(results, baseline, args.tolerance)
+    print "%d jobs, %d log lines" % (len(jobs), num_lines)
+    print_results(results, comparison)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'params' : params,
+                       'stages' : dict(
+                        (stage, {'seconds' : seconds,
+                                 'items'   : items,
+                                 'unit'    : unit,
+                                 'peak_mb' : peak})
+                        for (stage, seconds, items, unit, peak) in results)},
+                      f, indent=2, sort_keys=True)
+        print "Saved results to", args.baseline
+
+    if any(slower for (before, slower) in comparison):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
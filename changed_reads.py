@@ -0,0 +1,231 @@
+import argparse
+import numpy as np
+import os
+import sys
+
+from mapping_count_dist import changed_dtype, load_table, binary_filename
+
+# The changed reads file written by countalns has a row for every read
+# whose number of alignments differs between the two versions, in
+# order of sequence number. The index for it is a set of .npy files
+# next to it, all of which are memory-mapped, so a query only reads the
+# parts of them it needs:
+#
+#   NAME.npy              the records, with changed_dtype, sorted by
+#                         seqnum (the file countalns -b writes)
+#   NAME.blocks.npy       the first seqnum of each block of
+#                         block_records records
+#   NAME.transitions.npy  one row per (old_alns, new_alns) pair seen,
+#                         with the number of reads and where their
+#                         positions start in by_transition
+#   NAME.by_transition.npy  positions of the records, grouped by
+#                         transition and in seqnum order within each
+#
+# A point lookup searches the block index, which is small enough to
+# stay in memory, and then one block of records.
+block_records = 4096
+
+transition_dtype = np.dtype([
+        ('old_alns', np.int32),
+        ('new_alns', np.int32),
+        ('start',    np.int64),
+        ('reads',    np.int64)])
+
+index_parts = ['blocks', 'transitions', 'by_transition']
+
+def index_filename(filename, part):
+
+    """Return the name of the given part of the index for the changed
+reads file filename, which may be the text file or its .npy version."""
+
+    return '%s.%s.npy' % (os.path.splitext(filename)[0], part)
+
+def transition_keys(old_alns, new_alns):
+    return (old_alns.astype(np.int64) << 32) | new_alns
+
+def build_index(filename):
+
+    """Write the index for the changed reads file filename. A text file
+is converted to a .npy file next to it first. Records that aren't in
+order of seqnum are sorted. Returns the name of the .npy file."""
+
+    records = load_table(filename, changed_dtype, 'changed')
+    npy = filename if filename.endswith('.npy') else binary_filename(filename)
+
+    seqnums = records['seqnum']
+    if np.any(seqnums[1:] < seqnums[:-1]):
+        records = np.sort(records, order='seqnum', kind='mergesort')
+        seqnums = records['seqnum']
+    if npy != filename or not isinstance(records, np.memmap):
+        np.save(npy, records)
+
+    np.save(index_filename(npy, 'blocks'), seqnums[::block_records])
+
+    # A stable sort keeps each transition's records in seqnum order
+    keys = transition_keys(records['old_alns'], records['new_alns'])
+    order = np.argsort(keys, kind='mergesort')
+    (unique, starts, counts) = np.unique(keys[order], return_index=True,
+                                         return_counts=True)
+    transitions = np.zeros(len(unique), dtype=transition_dtype)
+    transitions['old_alns'] = unique >> 32
+    transitions['new_alns'] = unique & 0xffffffff
+    transitions['start']    = starts
+    transitions['reads']    = counts
+
+    np.save(index_filename(npy, 'transitions'), transitions)
+    np.save(index_filename(npy, 'by_transition'), order)
+    return npy
+
+class ChangedReads(object):
+
+    """Queries on an indexed changed reads file. Results are arrays with
+changed_dtype, in order of seqnum."""
+
+    def __init__(self, filename):
+        npy = filename if filename.endswith('.npy') else binary_filename(filename)
+        for f in [npy] + [index_filename(npy, part) for part in index_parts]:
+            if not os.path.exists(f):
+                raise Exception("%s isn't indexed, run changed_reads.py index %s" %
+                                (filename, filename))
+        if os.path.getmtime(index_filename(npy, 'blocks')) < os.path.getmtime(npy):
+            raise Exception("The index for %s is out of date, run "
+                            "changed_reads.py index %s" % (npy, npy))
+
+        self.records = load_table(npy, changed_dtype, 'changed')
+        self.blocks  = np.load(index_filename(npy, 'blocks'))
+        self.transitions = np.load(index_filename(npy, 'transitions'))
+        self.by_transition = np.load(index_filename(npy, 'by_transition'),
+                                     mmap_mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    def position(self, seqnum):
+
+        """Return the position of the first record with a seqnum of at
+least seqnum."""
+
+        b = max(np.searchsorted(self.blocks, seqnum, 'right') - 1, 0)
+        start = b * block_records
+        block = self.records['seqnum'][start:start + block_records]
+        return start + np.searchsorted(block, seqnum)
+
+    def lookup(self, seqnum):
+
+        """Return the record for seqnum, or None if it didn't change."""
+
+        i = self.position(seqnum)
+        if i < len(self.records) and self.records['seqnum'][i] == seqnum:
+            return self.records[i]
+        return None
+
+    def scan(self, start=None, stop=None):
+
+        """Return the records with seqnums from start up to but not
+including stop. Either may be None for no limit."""
+
+        first = 0 if start is None else self.position(start)
+        last  = len(self.records) if stop is None else self.position(stop)
+        return np.array(self.records[first:last])
+
+    def transition(self, old_alns, new_alns, start=None, stop=None):
+
+        """Return the records for the reads that went from old_alns
+alignments to new_alns, optionally only those with seqnums from start
+up to but not including stop."""
+
+        keys = transition_keys(self.transitions['old_alns'],
+                               self.transitions['new_alns'])
+        key = transition_keys(np.array([old_alns]), new_alns)[0]
+        t = np.searchsorted(keys, key)
+        if t == len(keys) or keys[t] != key:
+            return np.zeros(0, dtype=changed_dtype)
+
+        group = self.transitions[t]
+        positions = self.by_transition[group['start']:
+                                       group['start'] + group['reads']]
+        if start is not None:
+            positions = positions[np.searchsorted(positions,
+                                                  self.position(start)):]
+        if stop is not None:
+            positions = positions[:np.searchsorted(positions,
+                                                   self.position(stop))]
+        return self.records[np.asarray(positions)]
+
+def print_records(records, out=sys.stdout):
+    out.write('%s\t%s\t%s\n' % changed_dtype.names)
+    for row in records:
+        out.write('%d\t%d\t%d\n' % tuple(row))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="""Index the changed reads file written by countalns,
+        and look up reads in it without reading the whole file""")
+    commands = parser.add_subparsers(dest='command')
+
+    index = commands.add_parser(
+        'index', help="""Write the index for a changed reads file, converting
+        a text file to .npy first""")
+    index.add_argument('file', help="Changed reads file, as text or .npy")
+
+    lookup = commands.add_parser(
+        'lookup', help="Print the alignment counts of reads by seqnum")
+    lookup.add_argument('file', help="Indexed changed reads file")
+    lookup.add_argument('seqnums', nargs='+', type=int, metavar='SEQNUM')
+
+    scan = commands.add_parser(
+        'range', help="Print the changed reads with seqnums in a range")
+    scan.add_argument('file', help="Indexed changed reads file")
+    scan.add_argument('start', type=int, help="First seqnum")
+    scan.add_argument('stop', type=int, help="Seqnum to stop before")
+
+    transition = commands.add_parser(
+        'transition', help="""Print the reads that went from OLD_ALNS
+        alignments to NEW_ALNS, or with no counts given, how many reads
+        made each transition""")
+    transition.add_argument('file', help="Indexed changed reads file")
+    transition.add_argument('old_alns', nargs='?', type=int)
+    transition.add_argument('new_alns', nargs='?', type=int)
+    transition.add_argument(
+        '--start', type=int, metavar='SEQNUM',
+        help="Only show reads from this seqnum on")
+    transition.add_argument(
+        '--stop', type=int, metavar='SEQNUM',
+        help="Only show reads before this seqnum")
+
+    return parser.parse_args(argv)
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+
+    if args.command == 'index':
+        npy = build_index(args.file)
+        print "Indexed %s" % npy
+        return
+
+    changed = ChangedReads(args.file)
+
+    if args.command == 'lookup':
+        for seqnum in args.seqnums:
+            row = changed.lookup(seqnum)
+            if row is None:
+                print "%d\tunchanged" % seqnum
+            else:
+                print "%d\t%d\t%d" % tuple(row)
+
+    elif args.command == 'range':
+        print_records(changed.scan(args.start, args.stop))
+
+    elif args.command == 'transition':
+        if args.old_alns is None or args.new_alns is None:
+            print "reads\told_alns\tnew_alns"
+            for row in changed.transitions:
+                print "%d\t%d\t%d" % (row['reads'], row['old_alns'],
+                                      row['new_alns'])
+        else:
+            print_records(changed.transition(args.old_alns, args.new_alns,
+                                             args.start, args.stop))
+
+if __name__ == '__main__':
+    main()
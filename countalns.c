@@ -1,10 +1,18 @@
 #define _GNU_SOURCE
 #include <stdio.h>
+#include <errno.h>
 #include <string.h>
 #include <stdlib.h>
+#include <stdint.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <pthread.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 char *USAGE = " \n\
-Usage: %s OLD_DIR NEW_DIR DETAIL_OUT CLASS_COUNT_OUT CHANGED_READS_OUT \n\
+Usage: %s [-b] [-t THREADS] OLD_DIR NEW_DIR DETAIL_OUT CHANGED_READS_OUT CLASS_COUNT_OUT \n\
+       %s [-b] [-t THREADS] -n OUT_DIR DIR1 DIR2 [DIR3 ...]                \n\
                                                                        \n\
 OLD_DIR should be the directory containing the data produced by the    \n\
 old version of RUM, and NEW_DIR should contain the data produced by    \n\
@@ -21,100 +29,464 @@ or 'non-unique'. Each row indicates that the number of reads that were \n\
 in 'old_class' in the old version and 'new_class' in the new version.  \n\
                                                                        \n\
 CHANGED_READS_OUT will contain a list of sequence ids that had a       \n\
-different number of mappings on the old and new version.               \n\
+different number of mappings on the old and new version, along with    \n\
+the old and new number of alignments for each.                         \n\
+It is sorted by sequence id, and changed_reads.py can index it for      \n\
+looking up reads by id or by change in alignments.                     \n\
+                                                                       \n\
+Each input file is scanned by THREADS threads (default: the number of  \n\
+processors).                                                           \n\
+                                                                       \n\
+With -b, the outputs are written as numpy .npy files instead of text,  \n\
+each holding one array of fixed-width records that can be loaded with  \n\
+numpy.load(filename, mmap_mode='r'):                                   \n\
+                                                                       \n\
+  DETAIL_OUT         reads (int64), old_alns (int32), new_alns (int32) \n\
+  CHANGED_READS_OUT  seqnum (int64), old_alns (int32), new_alns (int32)\n\
+  CLASS_COUNT_OUT    reads (int64), old_class_num (int32),             \n\
+                     new_class_num (int32), one record for each of the \n\
+                     nine cells of the 3x3 class matrix                \n\
+                                                                       \n\
+The .npy header is padded to a multiple of 64 bytes, and its size      \n\
+depends on the fields: the three-column outputs have a 192-byte header,\n\
+but disagree and patterns have longer ones the more directories -n     \n\
+compares. Load the files with numpy.load rather than at a fixed offset.\n\
+                                                                       \n\
+With -n, up to 8 result directories are compared with each other in   \n\
+one pass, loading each of them once. OUT_DIR is created if needed and  \n\
+gets, numbering the directories from 1 (plus .npy with -b):            \n\
+                                                                       \n\
+  counts_I_J   DETAIL_OUT with DIRI as old and DIRJ as new, for I < J  \n\
+  classes_I_J  CLASS_COUNT_OUT for the same pair                       \n\
+  disagree     seqnum, alns_1, ..., alns_N for each read where the     \n\
+               versions don't all have the same number of alignments   \n\
+  patterns     reads, group_1, ..., group_N: the number of reads with  \n\
+               each pattern of agreement. Versions in the same group   \n\
+               have the same number of alignments for those reads,     \n\
+               and groups are numbered in order of first appearance,   \n\
+               so 0 1 0 means only DIR2 differs.                       \n\
 ";
 
-// Largest read sequence number we expect to see. 
-#define MAX_READS 100000000
+// Longest sequence number we parse, in characters.
+#define MAX_ID_SIZE 20
+
+// Smallest byte range of an input file worth giving its own thread.
+#define MIN_RANGE_SIZE (1 << 20)
 
 // Largest number of alignments for a read that we want to capture.
 #define MAX_ALNS 1000
 
-// OLD_READS maps sequence number to the number of alignments in the
-// "old" job, NEW_READS does the same for the "new" job.
-int OLD_READS[MAX_READS];
-int NEW_READS[MAX_READS];
-int MATRIX[MAX_ALNS][MAX_ALNS];
+// Read counts are stored in blocks of 2^BLOCK_BITS counters, which
+// are only allocated once a read in their range is seen. The block
+// directory covers sequence numbers up to 2^(BLOCK_BITS + DIR_BITS).
+#define BLOCK_BITS 16
+#define DIR_BITS   20
+#define BLOCK_SIZE (1L << BLOCK_BITS)
+#define NUM_BLOCKS (1L << DIR_BITS)
+#define MAX_READ_ID (BLOCK_SIZE * NUM_BLOCKS - 1)
+
+// Counters saturate at this value. Alignments past it are kept in the
+// overflow table.
+#define COUNT_MAX UINT16_MAX
+
+/**
+ * A hash table counting occurrences of non-negative ids, with open
+ * addressing. Empty slots have an id of -1.
+ */
+typedef struct {
+  long *ids;
+  long *counts;
+  long size;
+  long cap;
+} id_table;
+
+/**
+ * Maps sequence number to the number of alignments for the read. Each
+ * count is a 16-bit counter; for the rare read with more than
+ * COUNT_MAX alignments, the counter stays at COUNT_MAX and the rest
+ * are counted in the overflow table, which is guarded by
+ * overflow_lock.
+ */
+typedef struct {
+  uint16_t *blocks[NUM_BLOCKS];
+  long num_blocks;
+
+  pthread_mutex_t overflow_lock;
+  id_table overflow;
+} read_counts;
+
+// Number of alignments each read has in one version against the
+// number it has in another, for reads with fewer than MAX_ALNS in both
+typedef int aln_matrix[MAX_ALNS][MAX_ALNS];
+
+// Most versions that can be compared at once with -n
+#define MAX_VERSIONS 8
+
+// A row of DETAIL_OUT or CLASS_COUNT_OUT when writing binary output
+typedef struct {
+  int64_t reads;
+  int32_t old;
+  int32_t new;
+} count_record;
+
+// A row of CHANGED_READS_OUT when writing binary output
+typedef struct {
+  int64_t seqnum;
+  int32_t old_alns;
+  int32_t new_alns;
+} changed_record;
+
+// Field names of the binary outputs. The first field of each record
+// is a 64-bit integer and the rest are 32-bit integers.
+char *COUNT_FIELDS[]   = { "reads", "old_alns", "new_alns" };
+char *CLASS_FIELDS[]   = { "reads", "old_class_num", "new_class_num" };
+char *CHANGED_FIELDS[] = { "seqnum", "old_alns", "new_alns" };
+
+// Longest sequence number we print, in characters
+#define MAX_NUM_SIZE 20
 
 const int DIR_NONE = 0;
 const int DIR_FWD  = 1;
 const int DIR_REV  = 2;
 
+/**
+ * Return a pointer to the slot for id in table, or to the empty slot
+ * where it would go.
+ */
+long *id_table_slot(id_table *table, long id) {
+  long mask = table->cap - 1;
+  long i = (id * 0x9E3779B97F4A7C15UL >> 16) & mask;
+  while (table->ids[i] >= 0 && table->ids[i] != id) {
+    i = (i + 1) & mask;
+  }
+  return &table->ids[i];
+}
+
+/**
+ * Return the count for id in table, or 0 if it isn't there.
+ */
+long id_table_get(id_table *table, long id) {
+  if (!table->size) {
+    return 0;
+  }
+  long *slot = id_table_slot(table, id);
+  return *slot == id ? table->counts[slot - table->ids] : 0;
+}
+
+/**
+ * Add one to the count for id in table, growing it if needed.
+ */
+void id_table_add(id_table *table, long id) {
+
+  // Keep the table at most half full
+  if (table->size * 2 >= table->cap) {
+    long *old_ids    = table->ids;
+    long *old_counts = table->counts;
+    long  old_cap    = table->cap;
+    long  i;
+
+    table->cap    = old_cap ? old_cap * 2 : 64;
+    table->ids    = malloc(table->cap * sizeof(long));
+    table->counts = calloc(table->cap, sizeof(long));
+    if (!table->ids || !table->counts) {
+      perror("Growing id table");
+      exit(1);
+    }
+    memset(table->ids, -1, table->cap * sizeof(long));
+
+    for (i = 0; i < old_cap; i++) {
+      if (old_ids[i] >= 0) {
+        long *slot = id_table_slot(table, old_ids[i]);
+        *slot = old_ids[i];
+        table->counts[slot - table->ids] = old_counts[i];
+      }
+    }
+    free(old_ids);
+    free(old_counts);
+  }
+
+  long *slot = id_table_slot(table, id);
+  if (*slot < 0) {
+    *slot = id;
+    table->size++;
+  }
+  table->counts[slot - table->ids]++;
+}
+
+/**
+ * Allocate an empty read_counts.
+ */
+read_counts *new_read_counts() {
+  read_counts *counts = calloc(1, sizeof(read_counts));
+  if (!counts) {
+    perror("Allocating read counts");
+    exit(1);
+  }
+  pthread_mutex_init(&counts->overflow_lock, NULL);
+  return counts;
+}
+
+/**
+ * Add one alignment for read id. Safe to call from several threads at
+ * once.
+ */
+void add_read(read_counts *counts, long id) {
+  long b = id >> BLOCK_BITS;
+  uint16_t *block = counts->blocks[b];
+
+  if (!block) {
+    // Allocate the block, unless another thread beats us to it
+    uint16_t *fresh = calloc(BLOCK_SIZE, sizeof(uint16_t));
+    if (!fresh) {
+      perror("Allocating read counts");
+      exit(1);
+    }
+    if (__sync_bool_compare_and_swap(&counts->blocks[b], NULL, fresh)) {
+      block = fresh;
+      __sync_fetch_and_add(&counts->num_blocks, 1);
+    }
+    else {
+      free(fresh);
+      block = counts->blocks[b];
+    }
+  }
+
+  uint16_t *p = &block[id & (BLOCK_SIZE - 1)];
+  uint16_t v = *p;
+  while (v != COUNT_MAX) {
+    uint16_t seen = __sync_val_compare_and_swap(p, v, v + 1);
+    if (seen == v) {
+      return;
+    }
+    v = seen;
+  }
+  pthread_mutex_lock(&counts->overflow_lock);
+  id_table_add(&counts->overflow, id);
+  pthread_mutex_unlock(&counts->overflow_lock);
+}
+
+/**
+ * Return the number of alignments for read id.
+ */
+long get_read(read_counts *counts, long id) {
+  uint16_t *block = counts->blocks[id >> BLOCK_BITS];
+  if (!block) {
+    return 0;
+  }
+  long count = block[id & (BLOCK_SIZE - 1)];
+  if (count == COUNT_MAX) {
+    count += id_table_get(&counts->overflow, id);
+  }
+  return count;
+}
+
+/**
+ * Parse the line from line up to (not including) eol, which should
+ * look like "seq.<id>[ab]\t...". Sets *id to the sequence number and
+ * *dir to DIR_FWD or DIR_REV if the id is followed by an 'a' or 'b'
+ * mate suffix, or DIR_NONE otherwise.
+ */
+void parse_read_id(const char *line, const char *eol, long *id, int *dir) {
+  const char *p = line + 4;
+  const char *id_end = p;
+
+  while (id_end < eol && !strchr("ab\t\n", *id_end)) {
+    id_end++;
+  }
+
+  *dir = DIR_NONE;
+  if (id_end < eol) {
+    switch (*id_end) {
+      case 'a': *dir = DIR_FWD; break;
+      case 'b': *dir = DIR_REV; break;
+    }
+  }
+
+  char id_str[MAX_ID_SIZE];
+  int idlen = id_end - p;
+  if (idlen > MAX_ID_SIZE - 1) {
+    idlen = MAX_ID_SIZE - 1;
+  }
+  memcpy(id_str, p, idlen);
+  id_str[idlen] = 0;
+  *id = atol(id_str);
+}
+
+/**
+ * The work for one thread of load_reads_from_file: a line-aligned
+ * byte range of a memory-mapped file, and the counters the thread
+ * fills in.
+ */
+typedef struct {
+  const char *data;
+  size_t start;
+  size_t stop;
+  read_counts *dest;
+  long max_id;
+  long count;
+} scan_range;
+
+void *scan_range_thread(void *arg) {
+  scan_range *r = arg;
+  const char *p   = r->data + r->start;
+  const char *end = r->data + r->stop;
+
+  long last_id  = 0;
+  int  last_dir = DIR_NONE;
+
+  // A range that starts with the 'b' mate of a pair needs to know about
+  // the 'a' mate at the end of the previous range, so parse the line
+  // before the range as if it had been the last one seen.
+  if (r->start > 0) {
+    const char *prev_eol = r->data + r->start - 1;
+    const char *prev = prev_eol;
+    while (prev > r->data && prev[-1] != '\n') {
+      prev--;
+    }
+    if (prev_eol - prev >= 4) {
+      parse_read_id(prev, prev_eol, &last_id, &last_dir);
+    }
+  }
+
+  while (p < end) {
+    const char *eol = memchr(p, '\n', end - p);
+    if (!eol) {
+      eol = end;
+    }
+
+    if (eol - p >= 4) {
+      long id;
+      int dir;
+      parse_read_id(p, eol, &id, &dir);
+
+      if (id < 0 || id > MAX_READ_ID) {
+        fprintf(stderr, "ID out of range: %ld\n", id);
+      }
+      else {
+        if (id == last_id &&
+            last_dir == DIR_FWD &&
+            dir      == DIR_REV) {
+        }
+        else {
+          add_read(r->dest, id);
+        }
+
+        if (id > r->max_id) {
+          r->max_id = id;
+        }
+      }
+
+      last_id  = id;
+      last_dir = dir;
+      r->count++;
+    }
+
+    p = eol + 1;
+  }
+
+  return NULL;
+}
+
 /**
  * Populate dest with a mapping from sequence number to the number of
  * alignments for the corresponding read, based on the contents of
  * filename, which should point to a RUM_Unique or RUM_NU file. max_id
  * will be adjusted to be the larger of the incoming max_id and the
  * largest sequence number read from the file.
+ *
+ * The file is memory-mapped and split into num_threads ranges that
+ * each start at the beginning of a line, which are scanned in
+ * parallel. Each thread keeps its own line count and largest id,
+ * which are combined when they are all done.
  */
-int load_reads_from_file(char *filename, int *dest, long *max_id) {
+int load_reads_from_file(char *filename, read_counts *dest, long *max_id,
+                         int num_threads) {
   printf("  Loading reads from %s\n", filename);
 
-  FILE *f = fopen(filename, "r");
-  if (!f) {
+  int fd = open(filename, O_RDONLY);
+  if (fd < 0) {
     perror(filename);
     return -1;
   }
 
-  const int max_id_size = 20;
-
-  char *line = NULL;
-  size_t linecap = 0;
-  long linelen = 0;
+  struct stat st;
+  if (fstat(fd, &st) < 0) {
+    perror(filename);
+    close(fd);
+    return -1;
+  }
+  size_t size = st.st_size;
 
-  int last_id  = 0;
-  int last_dir = 0;
+  if (size == 0) {
+    close(fd);
+    printf("Max id is %ld\n", *max_id);
+    return 0;
+  }
 
-  char id_str[max_id_size];
+  const char *data = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+  close(fd);
+  if (data == MAP_FAILED) {
+    perror(filename);
+    return -1;
+  }
+  madvise((void *)data, size, MADV_SEQUENTIAL);
 
-  long count = 0;
+  // Don't bother with threads for small files
+  if (num_threads > size / MIN_RANGE_SIZE) {
+    num_threads = size / MIN_RANGE_SIZE;
+  }
+  if (num_threads < 1) {
+    num_threads = 1;
+  }
 
-  while ((linelen = getline(&line, &linecap, f)) > 0) {
+  scan_range *ranges  = calloc(num_threads, sizeof(scan_range));
+  pthread_t  *threads = calloc(num_threads, sizeof(pthread_t));
+  size_t start = 0;
+  int i;
 
-    char *id_start_p = line + 4;
-    int idlen = strcspn(id_start_p, "ab\t\n");
-    
-    int dir = DIR_NONE;
-    
-    switch (id_start_p[idlen]) {
-      case 'a': dir = DIR_FWD; break;
-      case 'b': dir = DIR_REV; break;
+  for (i = 0; i < num_threads; i++) {
+    size_t stop = size;
+    if (i < num_threads - 1) {
+      // Move each boundary forward to the start of the next line
+      stop = size / num_threads * (i + 1);
+      if (stop < start) {
+        stop = start;
+      }
+      const char *eol = memchr(data + stop, '\n', size - stop);
+      stop = eol ? eol - data + 1 : size;
     }
+    ranges[i].data  = data;
+    ranges[i].start = start;
+    ranges[i].stop  = stop;
+    ranges[i].dest  = dest;
+    start = stop;
 
-    strncpy(id_str, id_start_p, idlen);
-    id_str[idlen] = 0;
-    long id = atol(id_str);
-    
-    if (id > MAX_READS) {
-      fprintf(stderr, "ID too large: %ld\n", id);
-    }
-    if (id == last_id &&
-        last_dir == DIR_FWD &&
-        dir      == DIR_REV) {
-    }
-    else {
-      dest[id]++;
+    if (pthread_create(&threads[i], NULL, scan_range_thread, &ranges[i])) {
+      perror("pthread_create");
+      return -1;
     }
+  }
 
-    last_id = id;
-    last_dir = dir;
-
-    if (id > *max_id) {
-      *max_id = id;
-    }
-    
-    if ((++count % 10000000) == 0) {
-      printf("%10ld\n", count);
+  long count = 0;
+  for (i = 0; i < num_threads; i++) {
+    pthread_join(threads[i], NULL);
+    count += ranges[i].count;
+    if (ranges[i].max_id > *max_id) {
+      *max_id = ranges[i].max_id;
     }
-
   }
 
-  fclose(f);
+  free(ranges);
+  free(threads);
+  munmap((void *)data, size);
+
+  printf("%10ld lines with %d threads\n", count, num_threads);
   printf("Max id is %ld\n", *max_id);
   return 0;
 }
 
-int load_reads_from_dir(char *dir, int *dest, long *max_id) {
+int load_reads_from_dir(char *dir, read_counts *dest, long *max_id,
+                        int num_threads) {
   printf("Loading reads from %s\n", dir);
 
   char *suffixes[] = { "/RUM_Unique", 
@@ -123,11 +495,11 @@ int load_reads_from_dir(char *dir, int *dest, long *max_id) {
   int i;
 
   for (i = 0; i < 2; i++) {
-    int len = strlen(dir) + strlen(suffixes[i]);
+    int len = strlen(dir) + strlen(suffixes[i]) + 1;
     char *filename = malloc(len);
     strcpy(filename, dir);
     strcat(filename, suffixes[i]);
-    if (load_reads_from_file(filename, dest, max_id) < 0) {
+    if (load_reads_from_file(filename, dest, max_id, num_threads) < 0) {
       return -1;
     }
     free(filename);
@@ -136,109 +508,563 @@ int load_reads_from_dir(char *dir, int *dest, long *max_id) {
   return 0;
 }
 
-int main (int argc, char **argv) {
+/**
+ * Return the size of the .npy header for records with the given
+ * fields. Binary outputs start with a header padded to this size, so
+ * that it can be rewritten with the final record count in place.
+ */
+int npy_header_size(char **names, int num_fields) {
+  int len = 10 + strlen("{'descr': [], 'fortran_order': False, "
+                        "'shape': (,), }\n") + MAX_NUM_SIZE;
+  int i;
+  for (i = 0; i < num_fields; i++) {
+    len += strlen("('', '<i8'), ") + strlen(names[i]);
+  }
+  return (len + 63) / 64 * 64;
+}
 
-  if (argc < 6) {
-    printf(USAGE, argv[0]);
-    return 1;
+/**
+ * Write a .npy header to f, which must be positioned at the start of
+ * the file, for a one-dimensional array of num_records records with
+ * the given fields: a 64-bit integer called names[0] followed by
+ * 32-bit integers.
+ */
+int write_npy_header(FILE *f, long num_records,
+                     char **names, int num_fields) {
+
+  // Fields are written in the machine's byte order
+  uint16_t one = 1;
+  char order = *(char *)&one ? '<' : '>';
+  int size = npy_header_size(names, num_fields);
+  int i;
+
+  // The magic string and version 1.0, followed by the length of the
+  // rest of the header as a little-endian 16-bit integer
+  char header[size + 1];
+  memcpy(header, "\x93NUMPY\x01\x00", 8);
+  header[8] = (size - 10) & 0xff;
+  header[9] = (size - 10) >> 8;
+
+  int len = 10 + sprintf(header + 10, "{'descr': [");
+  for (i = 0; i < num_fields; i++) {
+    len += sprintf(header + len, "%s('%s', '%c%s')", i ? ", " : "",
+                   names[i], order, i ? "i4" : "i8");
   }
+  len += sprintf(header + len, "], 'fortran_order': False, 'shape': (%ld,), }",
+                 num_records);
 
-  char *old_dir          = argv[1];
-  char *new_dir          = argv[2];
-  char *out              = argv[3];
-  char *changed_filename = argv[4];
-  char *classes_filename = argv[5];
+  // Pad with spaces up to a newline at the end of the header
+  memset(header + len, ' ', size - len);
+  header[size - 1] = '\n';
 
-  long max_id = 0;
+  if (fwrite(header, size, 1, f) != 1) {
+    perror("Writing .npy header");
+    return -1;
+  }
+  return 0;
+}
+
+/**
+ * Rewrite the .npy header at the start of f with the number of
+ * records that were written after it.
+ */
+int finish_npy(FILE *f, char **names, int num_fields) {
+  size_t record_size = sizeof(int64_t) + (num_fields - 1) * sizeof(int32_t);
+  long size = ftell(f);
+  long num_records = (size - npy_header_size(names, num_fields)) / record_size;
+  if (fseek(f, 0, SEEK_SET) < 0) {
+    perror("Rewriting .npy header");
+    return -1;
+  }
+  return write_npy_header(f, num_records, names, num_fields);
+}
 
-  printf("Initializing matrices\n");
-  bzero(OLD_READS, sizeof(OLD_READS));
-  bzero(NEW_READS, sizeof(NEW_READS));
-  bzero(MATRIX, sizeof(MATRIX));
+/**
+ * Write one record of a binary output: a 64-bit integer followed by
+ * num_values 32-bit integers.
+ */
+void write_record(FILE *f, int64_t first, int32_t *values, int num_values) {
+  fwrite(&first, sizeof(first), 1, f);
+  fwrite(values, sizeof(int32_t), num_values, f);
+}
 
-  if (load_reads_from_dir(old_dir, OLD_READS, &max_id) < 0) {
-    printf("Exiting");
+FILE *open_output(char *filename, int binary) {
+  FILE *f = fopen(filename, binary ? "wb" : "w");
+  if (!f) {
+    perror(filename);
+  }
+  else {
+    setvbuf(f, NULL, _IOFBF, 1 << 20);
+  }
+  return f;
+}
+
+/**
+ * Return 0, 1, or 2 for a read with no alignments, one alignment
+ * ("unique"), or more than one ("non-unique").
+ */
+int aln_class(long alns) {
+  return alns == 0 ? 0 : alns == 1 ? 1 : 2;
+}
+
+/**
+ * Write the rows of matrix that have any reads to f, as DETAIL_OUT,
+ * and close it.
+ */
+int write_matrix(FILE *f, aln_matrix matrix, int binary) {
+  long i, j;
+
+  if (binary) {
+    if (write_npy_header(f, 0, COUNT_FIELDS, 3) < 0) {
+      return -1;
+    }
+  }
+  else {
+    fprintf(f, "%s\t%s\t%s\n", 
+            "reads", "old_alns", "new_alns");
+  }
+  for (i = 0; i < MAX_ALNS; i++) {
+    for (j = 0; j < MAX_ALNS; j++) {
+      int num_reads = matrix[i][j];
+      if (num_reads) {
+        if (binary) {
+          count_record rec = { num_reads, i, j };
+          fwrite(&rec, sizeof(rec), 1, f);
+        }
+        else {
+          fprintf(f, "%d\t%ld\t%ld\n", num_reads, i, j);
+        }
+      }
+    }
+  }
+
+  if (binary && finish_npy(f, COUNT_FIELDS, 3) < 0) {
     return -1;
   }
-  if (load_reads_from_dir(new_dir, NEW_READS, &max_id) < 0) {
-    printf("Exiting");
+  if (fclose(f)) {
+    perror("Closing output");
     return -1;
   }
+  return 0;
+}
+
+/**
+ * Write the 3x3 class count matrix to f, as CLASS_COUNT_OUT, and close
+ * it.
+ */
+int write_classes(FILE *f, long classes[3][3], int binary) {
+  long i, j;
+
+  if (binary) {
+    if (write_npy_header(f, 9, CLASS_FIELDS, 3) < 0) {
+      return -1;
+    }
+  }
+  else {
+    fprintf(f, "%s\t%s\t%s\n", 
+            "reads", "old_class", "new_class");
+  }
+  for (i = 0; i < 3; i++) {
+    for (j = 0; j < 3; j++) {
+      if (binary) {
+        count_record rec = { classes[i][j], i, j };
+        fwrite(&rec, sizeof(rec), 1, f);
+      }
+      else {
+        fprintf(f, "%ld\t%ld\t%ld\n",
+                classes[i][j], i, j);
+      }
+    }
+  }
+
+  if (fclose(f)) {
+    perror("Closing output");
+    return -1;
+  }
+  return 0;
+}
 
-  FILE *changed_f = fopen(changed_filename, "w");
+/**
+ * Compare the alignment counts in old and new for every read up to
+ * max_id, and write the three outputs described in USAGE.
+ */
+int compare_two(read_counts *old, read_counts *new, long max_id, int binary,
+                char *out, char *changed_filename, char *classes_filename) {
+
+  FILE *changed_f = open_output(changed_filename, binary);
   if (!changed_f) { 
-    perror(changed_filename); 
     return -1;
   };
 
-  FILE *out_f = fopen(out, "w");  
+  FILE *out_f = open_output(out, binary);
   if (!out_f) { 
-    perror(out); 
     return -1;
   };
 
-  FILE *classes_f = fopen(classes_filename, "w");  
+  FILE *classes_f = open_output(classes_filename, binary);
   if (!classes_f) { 
-    perror(classes_filename); 
     return -1;
   };
 
-  int aln_type_counts[3][3];
+  aln_matrix *matrix = calloc(1, sizeof(aln_matrix));
+  long aln_type_counts[3][3];
   bzero(aln_type_counts, sizeof(aln_type_counts));
 
-  int i, j;
-  fprintf(changed_f, "%s\t%s\t%s\n", "seqnum", "old_alns", "new_alns");
+  long i;
+  if (binary) {
+    if (write_npy_header(changed_f, 0, CHANGED_FIELDS, 3) < 0) {
+      return -1;
+    }
+  }
+  else {
+    fprintf(changed_f, "%s\t%s\t%s\n", "seqnum", "old_alns", "new_alns");
+  }
 
-  for (i = 0; i < max_id; i++) {
-    int old_reads = OLD_READS[i];
-    int new_reads = NEW_READS[i];
-    if (old_reads > MAX_ALNS ||
-        new_reads > MAX_ALNS) {
+  for (i = 0; i <= max_id; i++) {
+    long old_reads = get_read(old, i);
+    long new_reads = get_read(new, i);
+    if (old_reads >= MAX_ALNS ||
+        new_reads >= MAX_ALNS) {
       fprintf(stderr, 
-              "Read %d has too many alignments (%d and %d), max is %d\n",
-              i, old_reads, new_reads, MAX_ALNS);
+              "Read %ld has too many alignments (%ld and %ld), max is %d\n",
+              i, old_reads, new_reads, MAX_ALNS - 1);
     }
     else if (old_reads || new_reads) {
-      MATRIX[old_reads][new_reads]++;
-    }
-
-    int old_aln_type 
-      = old_reads == 0 ? 0 
-      : old_reads == 1 ? 1 
-      :                  2;
-    int new_aln_type 
-      = new_reads == 0 ? 0 
-      : new_reads == 1 ? 1 
-      :                  2;
-    aln_type_counts[old_aln_type][new_aln_type]++;
+      (*matrix)[old_reads][new_reads]++;
+    }
+
+    aln_type_counts[aln_class(old_reads)][aln_class(new_reads)]++;
     
     if (old_reads != new_reads) {
-      fprintf(changed_f, "%d\t%d\t%d\n", i, old_reads, new_reads);
+      if (binary) {
+        changed_record rec = { i, old_reads, new_reads };
+        fwrite(&rec, sizeof(rec), 1, changed_f);
+      }
+      else {
+        fprintf(changed_f, "%ld\t%ld\t%ld\n", i, old_reads, new_reads);
+      }
     }
   }
 
-  // Print the class count summary file
-  fprintf(classes_f, "%s\t%s\t%s\n", 
-          "reads", "old_class", "new_class");
-  for (i = 0; i < 3; i++) {
-    for (j = 0; j < 3; j++) {
-      fprintf(classes_f, "%d\t%d\t%d\n",
-              aln_type_counts[i][j], i, j);
+  if (binary && finish_npy(changed_f, CHANGED_FIELDS, 3) < 0) {
+    return -1;
+  }
+  if (fclose(changed_f)) {
+    perror("Closing output");
+    return -1;
+  }
+
+  if (write_classes(classes_f, aln_type_counts, binary) < 0 ||
+      write_matrix(out_f, *matrix, binary) < 0) {
+    return -1;
+  }
+
+  free(matrix);
+  return 0;
+}
+
+/**
+ * Return the name of the output called name in out_dir, with a .npy
+ * extension for binary output. The result must be freed.
+ */
+char *output_filename(char *out_dir, char *name, int binary) {
+  char *filename = malloc(strlen(out_dir) + strlen(name) + 6);
+  sprintf(filename, "%s/%s%s", out_dir, name, binary ? ".npy" : "");
+  return filename;
+}
+
+int compare_keys(const void *a, const void *b) {
+  long x = *(const long *)a;
+  long y = *(const long *)b;
+  return (x > y) - (x < y);
+}
+
+/**
+ * Compare the alignment counts of every read up to max_id across all
+ * num_versions versions in a single pass, and write into out_dir:
+ *
+ *   counts_I_J   DETAIL_OUT for version I as old and version J as new
+ *   classes_I_J  CLASS_COUNT_OUT for the same pair
+ *   disagree     seqnum and the alignments in each version, for every
+ *                read where the versions don't all agree
+ *   patterns     the number of reads that have each pattern of
+ *                agreement between versions
+ *
+ * A pattern gives each version a group number, numbering groups in
+ * the order they first appear, and versions in the same group have
+ * the same number of alignments for the read. So with three versions,
+ * 0 0 0 means they all agree and 0 1 0 means only the second version
+ * differs. Versions are numbered from 1 in file names.
+ */
+int compare_many(read_counts **versions, int num_versions, long max_id,
+                 int binary, char *out_dir) {
+
+  int num_pairs = num_versions * (num_versions - 1) / 2;
+  aln_matrix *matrices = calloc(num_pairs, sizeof(aln_matrix));
+  long (*classes)[3][3] = calloc(num_pairs, sizeof(*classes));
+  if (!matrices || !classes) {
+    perror("Allocating count matrices");
+    return -1;
+  }
+
+  char *disagree_fields[MAX_VERSIONS + 1];
+  char *pattern_fields[MAX_VERSIONS + 1];
+  int v, w, p;
+
+  disagree_fields[0] = "seqnum";
+  pattern_fields[0]  = "reads";
+  for (v = 0; v < num_versions; v++) {
+    disagree_fields[v + 1] = malloc(MAX_NUM_SIZE);
+    pattern_fields[v + 1]  = malloc(MAX_NUM_SIZE);
+    sprintf(disagree_fields[v + 1], "alns_%d", v + 1);
+    sprintf(pattern_fields[v + 1], "group_%d", v + 1);
+  }
+
+  char *filename = output_filename(out_dir, "disagree", binary);
+  FILE *disagree_f = open_output(filename, binary);
+  free(filename);
+  if (!disagree_f) {
+    return -1;
+  }
+  if (binary) {
+    if (write_npy_header(disagree_f, 0, disagree_fields,
+                         num_versions + 1) < 0) {
+      return -1;
+    }
+  }
+  else {
+    for (v = 0; v <= num_versions; v++) {
+      fprintf(disagree_f, "%s%c", disagree_fields[v],
+              v < num_versions ? '\t' : '\n');
     }
   }
 
-  // Print the main counts output file
-  fprintf(out_f, "%s\t%s\t%s\n", 
-          "reads", "old_alns", "new_alns");
-  for (i = 0; i < MAX_ALNS; i++) {
-    for (j = 0; j < MAX_ALNS; j++) {
-      int num_reads = MATRIX[i][j];
-      if (num_reads) {
-        fprintf(out_f, "%d\t%d\t%d\n", num_reads, i, j);
+  // Patterns are keyed by their group numbers, four bits each. All
+  // versions agreeing is by far the most common pattern, so it is just
+  // counted here rather than in the table.
+  id_table patterns = { 0 };
+  long agreed = 0;
+  long i;
+
+  for (i = 0; i <= max_id; i++) {
+    int32_t alns[MAX_VERSIONS];
+    int too_many = 0;
+
+    for (v = 0; v < num_versions; v++) {
+      long n = get_read(versions[v], i);
+      if (n >= MAX_ALNS) {
+        too_many = 1;
+      }
+      alns[v] = n;
+    }
+    if (too_many) {
+      fprintf(stderr, "Read %ld has too many alignments (", i);
+      for (v = 0; v < num_versions; v++) {
+        fprintf(stderr, "%s%d", v ? ", " : "", alns[v]);
+      }
+      fprintf(stderr, "), max is %d\n", MAX_ALNS - 1);
+    }
+
+    p = 0;
+    for (v = 0; v < num_versions; v++) {
+      for (w = v + 1; w < num_versions; w++, p++) {
+        if (alns[v] < MAX_ALNS && alns[w] < MAX_ALNS &&
+            (alns[v] || alns[w])) {
+          matrices[p][alns[v]][alns[w]]++;
+        }
+        classes[p][aln_class(alns[v])][aln_class(alns[w])]++;
+      }
+    }
+
+    long key = 0;
+    int num_groups = 1;
+    for (v = 1; v < num_versions; v++) {
+      long group = num_groups;
+      for (w = 0; w < v; w++) {
+        if (alns[w] == alns[v]) {
+          group = key >> (4 * w) & 0xf;
+          break;
+        }
+      }
+      if (group == num_groups) {
+        num_groups++;
+      }
+      key |= group << (4 * v);
+    }
+
+    if (!key) {
+      agreed++;
+    }
+    else {
+      id_table_add(&patterns, key);
+      if (binary) {
+        write_record(disagree_f, i, alns, num_versions);
+      }
+      else {
+        fprintf(disagree_f, "%ld", i);
+        for (v = 0; v < num_versions; v++) {
+          fprintf(disagree_f, "\t%d", alns[v]);
+        }
+        fprintf(disagree_f, "\n");
+      }
+    }
+  }
+
+  if (binary && finish_npy(disagree_f, disagree_fields, num_versions + 1) < 0) {
+    return -1;
+  }
+  if (fclose(disagree_f)) {
+    perror("Closing output");
+    return -1;
+  }
+
+  // Write the pairwise tables
+  p = 0;
+  for (v = 0; v < num_versions; v++) {
+    for (w = v + 1; w < num_versions; w++, p++) {
+      char name[MAX_NUM_SIZE];
+      FILE *f;
+
+      sprintf(name, "counts_%d_%d", v + 1, w + 1);
+      filename = output_filename(out_dir, name, binary);
+      f = open_output(filename, binary);
+      free(filename);
+      if (!f || write_matrix(f, matrices[p], binary) < 0) {
+        return -1;
       }
+
+      sprintf(name, "classes_%d_%d", v + 1, w + 1);
+      filename = output_filename(out_dir, name, binary);
+      f = open_output(filename, binary);
+      free(filename);
+      if (!f || write_classes(f, classes[p], binary) < 0) {
+        return -1;
+      }
+    }
+  }
+
+  // Write the patterns in order of their keys, starting with the one
+  // where all versions agree
+  long num_patterns = 0;
+  long *keys = malloc((patterns.size + 1) * sizeof(long));
+  keys[num_patterns++] = 0;
+  for (i = 0; i < patterns.cap; i++) {
+    if (patterns.ids[i] >= 0) {
+      keys[num_patterns++] = patterns.ids[i];
     }
   }
+  qsort(keys + 1, num_patterns - 1, sizeof(long), compare_keys);
 
+  filename = output_filename(out_dir, "patterns", binary);
+  FILE *patterns_f = open_output(filename, binary);
+  free(filename);
+  if (!patterns_f) {
+    return -1;
+  }
+  if (binary) {
+    if (write_npy_header(patterns_f, num_patterns, pattern_fields,
+                         num_versions + 1) < 0) {
+      return -1;
+    }
+  }
+  else {
+    for (v = 0; v <= num_versions; v++) {
+      fprintf(patterns_f, "%s%c", pattern_fields[v],
+              v < num_versions ? '\t' : '\n');
+    }
+  }
+  for (i = 0; i < num_patterns; i++) {
+    long reads = keys[i] ? id_table_get(&patterns, keys[i]) : agreed;
+    int32_t groups[MAX_VERSIONS];
+    for (v = 0; v < num_versions; v++) {
+      groups[v] = keys[i] >> (4 * v) & 0xf;
+    }
+    if (binary) {
+      write_record(patterns_f, reads, groups, num_versions);
+    }
+    else {
+      fprintf(patterns_f, "%ld", reads);
+      for (v = 0; v < num_versions; v++) {
+        fprintf(patterns_f, "\t%d", groups[v]);
+      }
+      fprintf(patterns_f, "\n");
+    }
+  }
+  if (fclose(patterns_f)) {
+    perror("Closing output");
+    return -1;
+  }
+
+  free(keys);
+  free(patterns.ids);
+  free(patterns.counts);
+  for (v = 1; v <= num_versions; v++) {
+    free(disagree_fields[v]);
+    free(pattern_fields[v]);
+  }
+  free(matrices);
+  free(classes);
   return 0;
 }
 
+int main (int argc, char **argv) {
+
+  int binary = 0;
+  int num_threads = sysconf(_SC_NPROCESSORS_ONLN);
+  char *out_dir = NULL;
+  int opt;
+
+  while ((opt = getopt(argc, argv, "bt:n:")) != -1) {
+    switch (opt) {
+    case 'b': binary = 1; break;
+    case 't': num_threads = atoi(optarg); break;
+    case 'n': out_dir = optarg; break;
+    default:
+      printf(USAGE, argv[0], argv[0]);
+      return 1;
+    }
+  }
+
+  int num_versions = out_dir ? argc - optind : 2;
+  if ((out_dir && (num_versions < 2 || num_versions > MAX_VERSIONS)) ||
+      (!out_dir && argc - optind < 5)) {
+    printf(USAGE, argv[0], argv[0]);
+    return 1;
+  }
+
+  // Each version's directory is loaded exactly once
+  read_counts *versions[MAX_VERSIONS];
+  long max_id = 0;
+  long num_blocks = 0;
+  long num_overflow = 0;
+  int v;
+
+  for (v = 0; v < num_versions; v++) {
+    versions[v] = new_read_counts();
+    if (load_reads_from_dir(argv[optind + v], versions[v], &max_id,
+                            num_threads) < 0) {
+      printf("Exiting");
+      return -1;
+    }
+    num_blocks   += versions[v]->num_blocks;
+    num_overflow += versions[v]->overflow.size;
+  }
+
+  printf("Read counts use %ld MB, %ld reads have more than %d alignments\n",
+         num_blocks * BLOCK_SIZE * sizeof(uint16_t) >> 20,
+         num_overflow, COUNT_MAX);
+
+  if (out_dir) {
+    if (mkdir(out_dir, 0777) < 0 && errno != EEXIST) {
+      perror(out_dir);
+      return -1;
+    }
+    for (v = 0; v < num_versions; v++) {
+      printf("Version %d is %s\n", v + 1, argv[optind + v]);
+    }
+    return compare_many(versions, num_versions, max_id, binary, out_dir);
+  }
+
+  return compare_two(versions[0], versions[1], max_id, binary,
+                     argv[optind + 2], argv[optind + 3], argv[optind + 4]);
+}
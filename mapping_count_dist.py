@@ -1,7 +1,3 @@
-import matplotlib
-matplotlib.use('pdf')
-
-import matplotlib.pyplot as plt
 import sys
 import re
 import numpy as np
@@ -10,47 +6,103 @@ import argparse
 import sqlite3
 import itertools
 
-table = []
-
-with open('data/counts') as f:
-    f.next()
-    for line in f:
-        row = tuple([float(x) for x in line.split()])
-        (count, old_alns, new_alns) = row
-        table.append(row)
+# The tables countalns writes. Each text file has a header line
+# followed by three tab-separated integer columns.
+counts_dtype = np.dtype([
+        ('reads',    np.int64),
+        ('old_alns', np.int32),
+        ('new_alns', np.int32)])
 
+classes_dtype = np.dtype([
+        ('reads',         np.int64),
+        ('old_class_num', np.int32),
+        ('new_class_num', np.int32)])
 
-table = np.array(table)
-C = table[:,0]
-x = table[:,1]
-y = table[:,2]
-plt.hexbin(x, y, C=C, bins='log', gridsize=100
-)
-plt.colorbar()
-plt.xlabel('alignments in v2.0.2')
-plt.ylabel('alignments in v2.0.3')
-plt.xlim(0, 1000)
-plt.ylim(0, 1000)
-plt.savefig('heatmap')
-
+changed_dtype = np.dtype([
+        ('seqnum',   np.int64),
+        ('old_alns', np.int32),
+        ('new_alns', np.int32)])
 
 classes = ['none', 'unique', 'non-unique']
 
-with open('data/classes') as f:
-    f.next()
-    table = []
-
-    for line in f:
-        row = tuple([float(x) for x in line.split()])
-        table.append(row)
-
-    table = np.array(table, dtype=[
-            ('reads', int),
-            ('old_class_num', int),
-            ('new_class_num', int)])
+def parse_table(filename, dtype):
+
+    """Read a text table written by countalns into an array of the given
+dtype. The whole file is parsed by numpy in one call rather than line
+by line."""
+
+    with open(filename) as f:
+        f.readline()
+        values = np.fromstring(f.read(), dtype=np.int64, sep=' ')
+
+    width = len(dtype.names)
+    if len(values) % width:
+        raise Exception("%s doesn't have %d columns in every row" %
+                        (filename, width))
+    return columns_to_table(values.reshape(-1, width), dtype)
+
+def columns_to_table(values, dtype):
+    table = np.zeros(len(values), dtype=dtype)
+    for (i, name) in enumerate(dtype.names):
+        table[name] = values[:, i]
+    return table
+
+def load_table(filename, dtype, name):
+
+    """Load a countalns table from filename. A .npy file is memory-mapped,
+so only the rows that are used are read. A .npz file holds several
+tables, and the one called name is read from it. Anything else is
+parsed as text. Binary tables may be stored either with the given
+dtype or as a plain N x 3 array of integers."""
+
+    if filename.endswith('.npy'):
+        table = np.load(filename, mmap_mode='r')
+    elif filename.endswith('.npz'):
+        with np.load(filename) as archive:
+            table = archive[name]
+    else:
+        return parse_table(filename, dtype)
+
+    if table.dtype.names is None:
+        if table.ndim != 2 or table.shape[1] != len(dtype.names):
+            raise Exception("%s should be an N x %d array" %
+                            (filename, len(dtype.names)))
+        return columns_to_table(table, dtype)
+    if table.dtype.names != dtype.names:
+        raise Exception("%s has columns %s, expected %s" %
+                        (filename, table.dtype.names, dtype.names))
+    return table
+
+def binary_filename(filename):
+
+    """Return the name of the .npy file save_table writes for the text
+table filename."""
+
+    return os.path.splitext(filename)[0] + '.npy'
+
+def save_table(filename, table):
+    np.save(filename, table)
+
+def plot_heatmap(counts):
+
+    # matplotlib is slow to import, and only needed here
+    import matplotlib
+    matplotlib.use('pdf')
+    import matplotlib.pyplot as plt
+
+    plt.hexbin(counts['old_alns'], counts['new_alns'], C=counts['reads'],
+               bins='log', gridsize=100)
+    plt.colorbar()
+    plt.xlabel('alignments in v2.0.2')
+    plt.ylabel('alignments in v2.0.3')
+    plt.xlim(0, 1000)
+    plt.ylim(0, 1000)
+    plt.savefig('heatmap')
+
+def print_class_changes(table):
 
     total = np.sum(table['reads'])
-    
+
     table = np.sort(table, order=('reads'))
     table = table[::-1]
 
@@ -69,10 +121,45 @@ with open('data/classes') as f:
         pct = reads * 100.0 / total
         acc += pct
         print "%s to %s: %d (%.5f%%) (%.5f%%)" % (old_class, new_class, reads, pct, acc)
-    
+
     print "%f: %f" % (num_changed, 100.0 * (num_changed / total))
     num_same = total - num_changed
     print "%f: %f" % (num_same, 100.0 * (num_same / total))
 
     print table
-    
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="""Plot the change in number of alignments per read
+        between two versions of RUM, from the output of countalns""")
+    parser.add_argument(
+        '--counts', default='data/counts', metavar='FILE',
+        help="""Alignment count table, as text, .npy, or .npz with a
+        'counts' array (default %(default)s)""")
+    parser.add_argument(
+        '--classes', default='data/classes', metavar='FILE',
+        help="""Mapping class table, as text, .npy, or .npz with a
+        'classes' array (default %(default)s)""")
+    parser.add_argument(
+        '--save-npy', action='store_true',
+        help="""Save text tables as .npy files next to them, which can be
+        given instead next time to skip parsing""")
+    return parser.parse_args(argv)
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+
+    counts = load_table(args.counts, counts_dtype, 'counts')
+    table  = load_table(args.classes, classes_dtype, 'classes')
+
+    if args.save_npy:
+        for (filename, t) in [(args.counts, counts), (args.classes, table)]:
+            if os.path.splitext(filename)[1] not in ('.npy', '.npz'):
+                save_table(binary_filename(filename), t)
+
+    plot_heatmap(counts)
+    print_class_changes(table)
+
+if __name__ == '__main__':
+    main()
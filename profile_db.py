@@ -0,0 +1,465 @@
+import argparse
+import numpy as np
+import os
+import sqlite3
+import sys
+import time
+
+from rumprof import (
+    step_names, job_names, source_names, event_dtype, proc_dtype,
+    step_table_dtype, stat_percentiles, log_parsers, START,
+    find_log_files, parse_log_source, parse_log_files, match_events,
+    infer_preproc_from_events, first_seen_steps, chunk_times, step_stats,
+    merge_job_stats, write_pages, seconds_per_hour, metric_columns)
+
+default_db = 'rum_profile.db'
+
+# One row per job directory, labeled with the RUM version it ran. A
+# version with several jobs is treated like a job name given more than
+# once to profile_jobs.py: the jobs are merged as copies.
+#
+# Each log file is recorded with its size and mtime, so ingesting a
+# job again only parses the files that have changed. Procs and the
+# 'log' START events used to infer pre-processing are kept per file,
+# and step_stats holds the per-step aggregates for each job that the
+# trend and report commands read.
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id       INTEGER PRIMARY KEY,
+    version  TEXT NOT NULL,
+    dir      TEXT NOT NULL UNIQUE,
+    started  INTEGER,
+    ingested REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    id       INTEGER PRIMARY KEY,
+    job      INTEGER NOT NULL REFERENCES jobs (id),
+    path     TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime    REAL NOT NULL,
+    UNIQUE (job, path)
+);
+
+CREATE TABLE IF NOT EXISTS procs (
+    job    INTEGER NOT NULL REFERENCES jobs (id),
+    file   INTEGER NOT NULL REFERENCES files (id),
+    seq    INTEGER NOT NULL,
+    step   TEXT NOT NULL,
+    source TEXT NOT NULL,
+    start  INTEGER NOT NULL,
+    stop   INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS procs_job_file ON procs (job, file);
+
+CREATE TABLE IF NOT EXISTS log_starts (
+    job    INTEGER NOT NULL REFERENCES jobs (id),
+    file   INTEGER NOT NULL REFERENCES files (id),
+    source TEXT NOT NULL,
+    time   INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS log_starts_job_file ON log_starts (job, file);
+
+CREATE TABLE IF NOT EXISTS step_stats (
+    job      INTEGER NOT NULL REFERENCES jobs (id),
+    step     TEXT NOT NULL,
+    version  TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    chunks   INTEGER NOT NULL,
+    total    REAL NOT NULL,
+    min      REAL NOT NULL,
+    %s,
+    max      REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS step_stats_job_step_version
+    ON step_stats (job, step, version);
+CREATE INDEX IF NOT EXISTS step_stats_step_version
+    ON step_stats (step, version);
+""" % ",\n    ".join("%-8s REAL NOT NULL" % name
+                    for (name, pct) in stat_percentiles)
+
+# step_stats columns and the step_stats() fields they come from
+stat_columns = ([('chunks', 'count'), ('total', 'sum'), ('min', 'min')] +
+                [(name, name) for (name, pct) in stat_percentiles] +
+                [('max', 'max')])
+
+def open_db(filename):
+    db = sqlite3.connect(filename)
+    db.text_factory = str
+    db.executescript(schema)
+    return db
+
+def file_stat(filename):
+    st = os.stat(filename)
+    return (st.st_size, st.st_mtime)
+
+def stale_files(db, dir, log_files):
+
+    """Return the files in log_files that the database has no record of
+for the job in dir, or that have changed size or mtime since they were
+ingested."""
+
+    known = dict((path, (size, mtime)) for (path, size, mtime) in db.execute(
+            """SELECT f.path, f.size, f.mtime
+               FROM files f JOIN jobs j ON f.job = j.id
+               WHERE j.dir = ?""", (dir,)))
+    return [f for f in log_files if known.get(f) != file_stat(f)]
+
+def ingest(db, jobs, scanner='cached', num_workers=1):
+
+    """Load the procs for each (version, dir) in jobs into db. A job
+whose log files are all unchanged since it was last ingested is
+skipped, and only new or changed files are parsed for the others. All
+of the jobs are written in a single transaction."""
+
+    plans = []
+    tasks = []
+    seen_dirs = set()
+
+    for (version, dir) in jobs:
+        dir = os.path.abspath(dir)
+        if dir in seen_dirs:
+            continue
+        seen_dirs.add(dir)
+
+        log_files = find_log_files(dir)
+        if not log_files:
+            raise Exception("I can't find any log files in " + dir)
+        stale = stale_files(db, dir, log_files)
+
+        row = db.execute("SELECT version, id FROM jobs WHERE dir = ?",
+                         (dir,)).fetchone()
+        known = set(path for (path,) in db.execute(
+                "SELECT path FROM files WHERE job = ?",
+                (row[1] if row else None,)))
+        if row and row[0] == version and not stale and known == set(log_files):
+            print "Skipping %s (%s), no log files have changed" % (dir, version)
+            continue
+
+        plans.append((version, dir, log_files, len(tasks), len(stale)))
+        tasks.extend([(f, version, scanner) for f in stale])
+
+    if num_workers > 1 and len(tasks) > 1:
+        events = parse_log_files(tasks, num_workers)
+    else:
+        events = [parse_log_source(*task) for task in tasks]
+
+    with db:
+        for (version, dir, log_files, first, count) in plans:
+            parsed = zip([t[0] for t in tasks[first:first + count]],
+                         events[first:first + count])
+            store_job(db, version, dir, log_files, parsed)
+            print "Ingested %s (%s), %d of %d log files parsed" % (
+                dir, version, count, len(log_files))
+
+def store_job(db, version, dir, log_files, parsed):
+
+    """Record the job in dir, whose log files are log_files, replacing
+the procs for each (filename, events) pair in parsed, then recompute
+its pre-processing time and step_stats."""
+
+    row = db.execute("SELECT id FROM jobs WHERE dir = ?", (dir,)).fetchone()
+    if row is None:
+        job = db.execute(
+            "INSERT INTO jobs (version, dir, ingested) VALUES (?, ?, ?)",
+            (version, dir, time.time())).lastrowid
+    else:
+        job = row[0]
+        db.execute("UPDATE jobs SET version = ?, ingested = ? WHERE id = ?",
+                   (version, time.time(), job))
+
+    # Forget files that have changed or are gone, along with the
+    # pre-processing proc, which depends on all of the files
+    replaced = set(filename for (filename, events) in parsed)
+    dead = [(job, id) for (id, path) in db.execute(
+            "SELECT id, path FROM files WHERE job = ?", (job,))
+            if path in replaced or path not in log_files]
+    db.execute("DELETE FROM procs WHERE job = ? AND seq < 0", (job,))
+    for table in ('procs', 'log_starts', 'files'):
+        column = 'id' if table == 'files' else 'file'
+        db.executemany("DELETE FROM %s WHERE job = ? AND %s = ?" %
+                       (table, column), dead)
+
+    log_step = step_names.code('log')
+
+    for (filename, events) in parsed:
+        (size, mtime) = file_stat(filename)
+        file = db.execute(
+            """INSERT INTO files (job, path, position, size, mtime)
+               VALUES (?, ?, 0, ?, ?)""",
+            (job, filename, size, mtime)).lastrowid
+
+        (procs, unmatched) = match_events(events)
+        db.executemany(
+            """INSERT INTO procs (job, file, seq, step, source, start, stop)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            ((job, file, seq, step_names.strings[p['step']],
+              source_names.strings[p['source']], int(p['start']),
+              int(p['stop']))
+             for (seq, p) in enumerate(procs)))
+
+        log_starts = unmatched[(unmatched['step'] == log_step) &
+                               (unmatched['type'] == START)]
+        db.executemany(
+            """INSERT INTO log_starts (job, file, source, time)
+               VALUES (?, ?, ?, ?)""",
+            ((job, file, source_names.strings[e['source']], int(e['time']))
+             for e in log_starts))
+
+    db.executemany(
+        "UPDATE files SET position = ? WHERE job = ? AND path = ?",
+        ((i, job, path) for (i, path) in enumerate(log_files)))
+
+    # Pre-processing runs from the first log file being started to the
+    # second, so it is inferred from the log starts of the whole job
+    preproc = infer_preproc_from_events(load_log_starts(db, job, version))
+    (file,) = db.execute(
+        """SELECT file FROM log_starts WHERE job = ? AND source = ?
+           LIMIT 1""",
+        (job, source_names.strings[preproc['source'][0]])).fetchone()
+    db.execute(
+        """INSERT INTO procs (job, file, seq, step, source, start, stop)
+           VALUES (?, ?, -1, ?, ?, ?, ?)""",
+        (job, file, 'Pre-processing',
+         source_names.strings[preproc['source'][0]],
+         int(preproc['start'][0]), int(preproc['stop'][0])))
+    db.execute("UPDATE jobs SET started = ? WHERE id = ?",
+               (int(preproc['start'][0]), job))
+
+    store_step_stats(db, job, version, load_job_procs(db, job, version))
+
+def store_step_stats(db, job, version, procs):
+
+    """Replace the step_stats rows for job with the distribution of
+chunk times for each step in procs, in the order the steps were first
+seen."""
+
+    stats = step_stats(chunk_times(procs))
+    stats = stats[np.searchsorted(stats['step'], first_seen_steps(procs))]
+
+    columns = [column for (column, field) in stat_columns]
+    db.execute("DELETE FROM step_stats WHERE job = ?", (job,))
+    db.executemany(
+        """INSERT INTO step_stats (job, step, version, position, %s)
+           VALUES (?, ?, ?, ?, %s)""" % (
+            ", ".join(columns), ", ".join("?" for c in columns)),
+        ([job, step_names.strings[row['step']], version, position] +
+         [row[field].item() for (column, field) in stat_columns]
+         for (position, row) in enumerate(stats)))
+
+def load_log_starts(db, job, version):
+
+    """Return the 'log' START events recorded for job, as an event array
+in log file order."""
+
+    rows = db.execute(
+        """SELECT s.source, s.time
+           FROM log_starts s JOIN files f ON s.file = f.id
+           WHERE s.job = ? ORDER BY f.position, s.rowid""", (job,)).fetchall()
+    events = np.zeros(len(rows), dtype=event_dtype)
+    if rows:
+        (sources, times) = zip(*rows)
+        events['time']   = times
+        events['type']   = START
+        events['step']   = step_names.code('log')
+        events['job']    = job_names.code(version)
+        events['source'] = source_names.codes(sources)
+    return events
+
+def load_job_procs(db, job, version):
+
+    """Return the procs recorded for job in the order profile_jobs.py
+produces them: pre-processing first, then each log file's procs in
+the order they finished."""
+
+    # Give the log files codes in the order they would have been parsed
+    load_log_starts(db, job, version)
+
+    rows = db.execute(
+        """SELECT p.step, p.source, p.start, p.stop
+           FROM procs p JOIN files f ON p.file = f.id
+           WHERE p.job = ? ORDER BY p.seq >= 0, f.position, p.seq""",
+        (job,)).fetchall()
+    procs = np.zeros(len(rows), dtype=proc_dtype)
+    if rows:
+        (steps, sources, starts, stops) = zip(*rows)
+        procs['step']   = step_names.codes(steps)
+        procs['start']  = starts
+        procs['stop']   = stops
+        procs['job']    = job_names.code(version)
+        procs['source'] = source_names.codes(sources)
+    return procs
+
+def load_step_table(db, job):
+
+    """Return the step_stats for job as a table like the one
+rumprof.procs_to_array builds."""
+
+    rows = db.execute(
+        """SELECT step, chunks, total, max FROM step_stats
+           WHERE job = ? ORDER BY position""", (job,)).fetchall()
+    return np.array(rows, dtype=step_table_dtype)
+
+def versions_by_date(db):
+
+    """Return the ingested versions, ordered by when their earliest job
+started."""
+
+    return [version for (version,) in db.execute(
+            """SELECT version FROM jobs GROUP BY version
+               ORDER BY MIN(started), version""")]
+
+def trend(db, metric, versions=None, steps=None):
+
+    """Return (versions, rows), where each row is a step name followed
+by the median time for that step over the jobs of each version, in
+seconds, or None for versions that never ran the step. Steps are in
+the order they were first seen."""
+
+    if not versions:
+        versions = versions_by_date(db)
+    column = metric_columns[metric]
+
+    query = """SELECT s.version, s.step, s.%s
+               FROM step_stats s JOIN jobs j ON s.job = j.id
+               WHERE s.version IN (%s)""" % (
+        column, ", ".join("?" for v in versions))
+    params = list(versions)
+    if steps:
+        query += " AND s.step IN (%s)" % ", ".join("?" for s in steps)
+        params.extend(steps)
+    query += " ORDER BY j.started, s.job, s.position"
+
+    times = {}
+    step_order = []
+    for (version, step, value) in db.execute(query, params):
+        if step not in times:
+            times[step] = {}
+            step_order.append(step)
+        times[step].setdefault(version, []).append(value)
+
+    rows = []
+    for step in step_order:
+        rows.append([step] + [np.median(times[step][v])
+                              if v in times[step] else None
+                              for v in versions])
+    return (versions, rows)
+
+def print_trend(versions, rows, out=sys.stdout):
+    width = max([len('Step')] + [len(row[0]) for row in rows])
+    cols  = [max(len(v), 8) for v in versions]
+
+    def line(cells):
+        out.write("  ".join(cells) + "\n")
+
+    line(["Step".ljust(width)] + [v.rjust(c) for (v, c) in zip(versions, cols)])
+    totals = [0.0] * len(versions)
+    for row in rows:
+        cells = [row[0].ljust(width)]
+        for (i, value) in enumerate(row[1:]):
+            if value is None:
+                cells.append('-'.rjust(cols[i]))
+            else:
+                totals[i] += value
+                cells.append(('%.2f' % (value / seconds_per_hour)).rjust(cols[i]))
+        line(cells)
+    line(["Total".ljust(width)] +
+         [('%.2f' % (t / seconds_per_hour)).rjust(c)
+          for (t, c) in zip(totals, cols)])
+
+def write_db_report(db, versions, straggler_factor):
+
+    """Write the profile_jobs.py report for the given versions from the
+database, with the first version as the baseline and the jobs of each
+version merged as copies."""
+
+    jobs = []
+    stats = {}
+    job_procs = []
+
+    for version in versions:
+        rows = db.execute(
+            "SELECT id, dir FROM jobs WHERE version = ? ORDER BY id",
+            (version,)).fetchall()
+        if not rows:
+            raise Exception("There are no jobs for version " + version)
+        for (job, dir) in rows:
+            jobs.append((version, dir))
+            stats.setdefault(version, []).append(load_step_table(db, job))
+            job_procs.append((version, dir, load_job_procs(db, job, version)))
+
+    tables = merge_job_stats(jobs, stats)
+    write_pages(tables, job_procs, straggler_factor)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="""Keep the step timings of RUM jobs in a SQLite
+        database, and compare them across versions""")
+    parser.add_argument(
+        '--db', default=default_db, metavar='FILE',
+        help="Database file (default %(default)s)")
+    commands = parser.add_subparsers(dest='command')
+
+    ingest = commands.add_parser(
+        'ingest', help="Parse the logs of jobs and add them to the database")
+    ingest.add_argument(
+        'job_dirs', nargs='+', metavar='VERSION=DIR',
+        help="""RUM version and the directory containing the logs of a
+        job that ran it. Jobs that have already been ingested are
+        updated, and only their new or changed log files are parsed.""")
+    ingest.add_argument(
+        '--jobs', '-j', dest='num_workers', type=int, default=1,
+        metavar='N',
+        help="Number of processes to use for parsing log files")
+    ingest.add_argument(
+        '--scanner', choices=sorted(log_parsers), default='cached',
+        help="Log parser to use, as for profile_jobs.py")
+
+    trend = commands.add_parser(
+        'trend', help="""Print the median hours per step for each version,
+        oldest first""")
+    trend.add_argument(
+        'versions', nargs='*', metavar='VERSION',
+        help="Versions to show (default all, ordered by date run)")
+    trend.add_argument(
+        '--metric', choices=sorted(metric_columns), default='cpu',
+        help="CPU time or wallclock time (default %(default)s)")
+    trend.add_argument(
+        '--step', dest='steps', action='append', metavar='STEP',
+        help="Only show this step; may be given more than once")
+
+    report = commands.add_parser(
+        'report', help="""Write the profile_jobs.py report for versions in
+        the database, without parsing any logs""")
+    report.add_argument(
+        'versions', nargs='+', metavar='VERSION',
+        help="Versions to compare, the first of which is the baseline")
+    report.add_argument(
+        '--straggler-factor', type=float, default=2.0, metavar='X',
+        help="""List chunks that took more than X times the median time
+        for a step as stragglers (default %(default)s)""")
+
+    return parser.parse_args(argv)
+
+def main():
+
+    args = parse_args(sys.argv[1:])
+    db = open_db(args.db)
+
+    if args.command == 'ingest':
+        jobs = [tuple(arg.split("=")) for arg in args.job_dirs]
+        ingest(db, jobs, args.scanner, args.num_workers)
+
+    elif args.command == 'trend':
+        (versions, rows) = trend(db, args.metric, args.versions, args.steps)
+        print_trend(versions, rows)
+
+    elif args.command == 'report':
+        write_db_report(db, args.versions, args.straggler_factor)
+
+if __name__ == '__main__':
+    main()
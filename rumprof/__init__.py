@@ -0,0 +1,46 @@
+"""Profile the running times of RUM jobs from their log files.
+
+The API comes in three layers, each working on the output of the one
+before, and each in its own module:
+
+    rumprof.parse      log files to event arrays, and events to procs,
+                       with one row per step run
+    rumprof.aggregate  procs to per-step tables for each copy of a job,
+                       merged across copies and then across jobs
+    rumprof.render     the HTML report and exports of the final table,
+                       written to output_dir
+
+rumprof.cli is the profile_jobs.py command line, main(), which runs
+them. For example, to get the table for one job without writing a
+report:
+
+    import rumprof
+    procs = rumprof.load_job_procs([('v2.0.3', 'jobs/v2.0.3')])
+    table = rumprof.procs_to_array(procs[0][2])
+
+Settings are module globals in the layer that uses them, so set them
+there: rumprof.parse.cache_dir and rumprof.render.output_dir.
+"""
+
+from rumprof.parse import (
+    START, FINISH, event_dtype, proc_dtype, step_names, job_names,
+    source_names, step_mapping, time_fmt, log_parsers, concat_events,
+    find_log_files, parse_log_file, scan_log_file, parse_log_source,
+    parse_log_files, load_events_for_job, load_events_for_jobs,
+    LogScanner, match_events, TimingBuilder, build_timings,
+    infer_preproc_from_events, procs_from_events, load_job_procs)
+
+from rumprof.aggregate import (
+    seconds_per_hour, step_table_dtype, stat_percentiles, metric_columns,
+    first_seen_steps, chunk_times, step_stats, find_stragglers,
+    procs_to_array, merge_copies, merge_job_stats, make_final_table,
+    calc_gain, step_parallelism, chunk_idle_times, replay_schedule,
+    critical_path, what_if_table, find_regressions, QuantileSketch,
+    StreamingJob)
+
+from rumprof.render import (
+    install_assets, write_pages, print_tables, print_stats_page,
+    print_timeline_page, print_critical_path_page, print_help_page,
+    write_exports)
+
+from rumprof.cli import parse_args, main
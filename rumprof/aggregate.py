@@ -0,0 +1,1090 @@
+"""Aggregation: turning procs into a table of times for each step of a
+copy of a job, merging the copies of each job, and merging the jobs
+into the final table that compares them to the first one. Also the
+schedule replays behind the critical path and what-if projections, and
+the summaries kept by --stream.
+"""
+
+import math
+import numpy as np
+import os
+import tarfile
+
+from collections import namedtuple
+
+from rumprof.parse import (
+    step_names, source_names, step_mapping, event_dtype, scan_counts,
+    log_file_pat, log_archive_pat, concat_events, open_log, LogScanner,
+    match_events)
+
+seconds_per_hour = 60.0 * 60.0
+
+StepTimes = namedtuple('StepTimes', 'steps offsets times sources')
+
+def group_times_by_step(procs):
+
+    """Group the durations of procs by step. Returns a StepTimes, where
+the times for step code steps[i] are times[offsets[i]:offsets[i + 1]],
+in the order the procs were given, and sources holds the code of the
+log file each time came from."""
+
+    order = np.argsort(procs['step'], kind='mergesort')
+    steps = procs['step'][order]
+    times = (procs['stop'] - procs['start'])[order].astype(float)
+
+    (codes, first) = np.unique(steps, return_index=True)
+    return StepTimes(codes, np.append(first, len(steps)), times,
+                     procs['source'][order])
+
+def new_step_name(step):
+    if step in step_mapping:
+        return step_mapping[step]
+    return step
+
+def renamed_step_codes():
+
+    """Return an array that maps each step code to the code of the name
+new_step_name gives it."""
+
+    return step_names.codes([new_step_name(s) for s in list(step_names.strings)])
+
+def first_seen_steps(procs):
+
+    """Return the codes of the steps in procs, after renaming, in the
+order they first appear."""
+
+    (codes, first) = np.unique(renamed_step_codes()[procs['step']],
+                               return_index=True)
+    return codes[np.argsort(first, kind='mergesort')]
+
+def chunk_times(procs):
+
+    """Return a StepTimes with the time each chunk spent in each step,
+after renaming."""
+
+    return rename_steps(group_times_by_step(procs))
+
+# The table procs_to_array returns for a job, with one row per step
+step_table_dtype = np.dtype([
+        ('step', 'S100'),
+        ('chunks', int),
+        ('total',  float),
+        ('max',    float)])
+
+def procs_to_array(procs):
+
+    steps = first_seen_steps(procs)
+    stats = step_stats(chunk_times(procs))
+    stats = stats[np.searchsorted(stats['step'], steps)]
+
+    table = np.zeros(len(steps), dtype=step_table_dtype)
+    table['step']   = step_names.lookup(steps)
+    table['chunks'] = stats['count']
+    table['total']  = stats['sum']
+    table['max']    = stats['max']
+    return table
+
+# Percentiles of the chunk times step_stats reports, besides min and max
+stat_percentiles = [
+    ('median', 50),
+    ('p90',    90),
+    ('p95',    95),
+    ('p99',    99),
+]
+
+def step_stats(times_for_step):
+
+    """Return a table with the distribution of chunk times for each step
+in the given StepTimes, in the same order. Percentiles are linearly
+interpolated, as numpy.percentile does. The straggler column is the
+ratio of the slowest chunk's time to the median."""
+
+    (steps, offsets, times, sources) = times_for_step
+    counts = np.diff(offsets)
+    starts = offsets[:-1]
+
+    # Sort the times within each step
+    group = np.repeat(np.arange(len(steps)), counts)
+    times = times[np.lexsort((times, group))]
+
+    table = np.zeros(len(steps), dtype=
+                     [('step', np.int32),
+                      ('count', int),
+                      ('sum', float),
+                      ('min', float)] +
+                     [(name, float) for (name, pct) in stat_percentiles] +
+                     [('max', float),
+                      ('straggler', float)])
+    table['step']  = steps
+    table['count'] = counts
+    table['sum']   = np.add.reduceat(times, starts)
+    table['min']   = times[starts]
+    table['max']   = times[starts + counts - 1]
+
+    for (name, pct) in stat_percentiles:
+        pos  = (counts - 1) * (pct / 100.)
+        lo   = np.floor(pos).astype(int)
+        hi   = np.minimum(lo + 1, counts - 1)
+        frac = pos - lo
+        table[name] = (times[starts + lo] +
+                       (times[starts + hi] - times[starts + lo]) * frac)
+
+    median = table['median']
+    table['straggler'] = table['max'] / np.where(median > 0, median, np.nan)
+    return table
+
+def find_stragglers(times_for_step, factor):
+
+    """Return a table of the chunk times in the given StepTimes that are
+more than factor times the median for their step, slowest relative to
+the median first."""
+
+    stats  = step_stats(times_for_step)
+    counts = np.diff(times_for_step.offsets)
+    median = np.repeat(stats['median'], counts)
+    slow   = (median > 0) & (times_for_step.times > factor * median)
+
+    table = np.zeros(np.count_nonzero(slow), dtype=[
+            ('step', np.int32),
+            ('source', np.int32),
+            ('time', float),
+            ('ratio', float)])
+    table['step']   = np.repeat(times_for_step.steps, counts)[slow]
+    table['source'] = times_for_step.sources[slow]
+    table['time']   = times_for_step.times[slow]
+    table['ratio']  = table['time'] / median[slow]
+    return table[np.argsort(-table['ratio'], kind='mergesort')]
+
+def rename_steps(times_for_step):
+
+    """Combine the times in the given StepTimes for steps that
+step_mapping maps to the same name, and return a new StepTimes. Times
+are added chunk by chunk, so the nth time for the new step is the sum
+of the nth times of the steps it is made of. A step that only ran once
+is added to every chunk. If the steps ran different numbers of times,
+which happens while a job is still running, the missing times count as
+zero."""
+
+    (steps, offsets, times, sources) = times_for_step
+    counts = np.diff(offsets)
+
+    renamed = renamed_step_codes()[steps]
+    (new_steps, new_index) = np.unique(renamed, return_inverse=True)
+
+    chunks = np.zeros(len(new_steps), dtype=int)
+    np.maximum.at(chunks, new_index, counts)
+    new_offsets = np.append(0, np.cumsum(chunks))
+
+    spread = (counts == 1) & (chunks[new_index] > 1)
+
+    group = np.repeat(np.arange(len(steps)), counts)
+    chunk = np.arange(len(times)) - offsets[group]
+    dest  = new_offsets[new_index[group]] + chunk
+    keep  = ~spread[group]
+
+    result = np.zeros(new_offsets[-1])
+    np.add.at(result, dest[keep], times[keep])
+
+    # Each chunk's log file, which is the same for all the steps that
+    # are added together except the ones added to every chunk
+    result_sources = np.zeros(new_offsets[-1], dtype=np.int32) - 1
+    result_sources[dest[keep]] = sources[keep]
+
+    spread_times = np.zeros(len(new_steps))
+    np.add.at(spread_times, new_index[spread], times[offsets[:-1][spread]])
+    result += np.repeat(spread_times, chunks)
+
+    return StepTimes(new_steps, new_offsets, result, result_sources)
+
+def concurrency_curve(procs):
+
+    """Sweep over the start and stop times of procs. Returns (times,
+counts), where counts[i] procs are running from times[i] until
+times[i + 1]. A proc that stops at the same time another one starts
+doesn't overlap it."""
+
+    times  = np.concatenate([procs['start'], procs['stop']])
+    deltas = np.concatenate([np.ones(len(procs), dtype=int),
+                             -np.ones(len(procs), dtype=int)])
+    order  = np.lexsort((deltas, times))
+    times  = times[order]
+    counts = np.cumsum(deltas[order])
+
+    # Only keep the count after the last change at each time
+    last = np.append(times[1:] != times[:-1], True)
+    return (times[last], counts[last])
+
+def step_parallelism(procs):
+
+    """Return a table with the peak and average number of chunks running
+each step at once, with steps named and ordered as in procs_to_array.
+The average is the total time spent in the step divided by the time
+from the first chunk starting it to the last one finishing it."""
+
+    steps = renamed_step_codes()[procs['step']]
+    codes = first_seen_steps(procs)
+
+    # Sweep over each step's procs separately. Every proc's start is
+    # cancelled out by its stop, so the running count goes back to zero
+    # at the end of each step and one cumsum covers all of them.
+    n = len(procs)
+    step   = np.concatenate([steps, steps])
+    times  = np.concatenate([procs['start'], procs['stop']])
+    deltas = np.concatenate([np.ones(n, dtype=int), -np.ones(n, dtype=int)])
+    order  = np.lexsort((deltas, times, step))
+    step   = step[order]
+    counts = np.cumsum(deltas[order])
+    bounds = np.flatnonzero(np.append(True, step[1:] != step[:-1]))
+    rows   = np.searchsorted(step[bounds], codes)
+
+    by_step = np.argsort(steps, kind='mergesort')
+    sorted_steps = steps[by_step]
+    proc_bounds = np.flatnonzero(
+        np.append(True, sorted_steps[1:] != sorted_steps[:-1]))
+    start = procs['start'][by_step]
+    stop  = procs['stop'][by_step]
+
+    busy = np.add.reduceat((stop - start).astype(float), proc_bounds)[rows]
+    span = (np.maximum.reduceat(stop, proc_bounds) -
+            np.minimum.reduceat(start, proc_bounds))[rows].astype(float)
+    peak = np.maximum.reduceat(counts, bounds)[rows]
+
+    table = np.zeros(len(codes), dtype=[
+            ('step', 'S100'),
+            ('procs', int),
+            ('busy', float),
+            ('span', float),
+            ('peak', int),
+            ('average', float)])
+    table['step']    = step_names.lookup(codes)
+    table['procs']   = np.diff(np.append(proc_bounds, n))[rows]
+    table['busy']    = busy
+    table['span']    = span
+    table['peak']    = peak
+    table['average'] = np.where(span > 0, busy / np.maximum(span, 1), peak)
+    return table
+
+def chunk_idle_times(procs):
+
+    """Return a table with, for each log file that procs came from, the
+time from its first step starting to its last one finishing, the time
+spent running steps, and the idle time in gaps between steps."""
+
+    order  = np.lexsort((procs['start'], procs['source']))
+    source = procs['source'][order]
+    start  = procs['start'][order]
+    stop   = procs['stop'][order]
+
+    new_chunk = np.append(True, source[1:] != source[:-1])
+    bounds = np.flatnonzero(new_chunk)
+
+    # The latest stop time so far within each chunk. Each chunk's times
+    # are shifted past all the earlier chunks' times, so that a single
+    # running maximum doesn't carry over from one chunk to the next.
+    shift  = (np.cumsum(new_chunk) - 1) * (stop.max() - start.min() + 1)
+    latest = np.maximum.accumulate(stop + shift) - shift
+
+    gaps = np.zeros(len(start), dtype=np.int64)
+    gaps[1:] = np.maximum(start[1:] - latest[:-1], 0)
+    gaps[bounds] = 0
+
+    table = np.zeros(len(bounds), dtype=[
+            ('source', 'S1000'),
+            ('span', float),
+            ('busy', float),
+            ('idle', float)])
+    table['source'] = source_names.lookup(source[bounds])
+    table['span'] = (np.maximum.reduceat(stop, bounds) -
+                     np.minimum.reduceat(start, bounds))
+    table['idle'] = np.add.reduceat(gaps, bounds)
+    table['busy'] = table['span'] - table['idle']
+    return table
+
+# A job's schedule as worked out by replay_schedule. order sorts the
+# procs by log file and then start time, and the procs from the kth log
+# file are at positions bounds[k] up to bounds[k + 1] in that order.
+# start and stop are the times of the sorted procs, and waited_for[k] is
+# the position of the proc that the first step in the kth log file
+# waited for, or -1 if it didn't wait for anything.
+Schedule = namedtuple('Schedule', 'order bounds start stop waited_for')
+
+def replay_schedule(procs, durations=None):
+
+    """Work out when each of procs would have run if they had taken the
+given durations in seconds, indexed like procs, rather than the time
+they actually took. With no durations, the schedule has the times from
+the logs.
+
+The steps in a log file run one after another, each starting as long
+after the previous one finished as it did in the log. The first step in
+a log file waits for every step in the other logs that had finished by
+the time it started, which is how the chunks wait for pre-processing
+and post-processing waits for all the chunks, and starts as long after
+the last of those finishes as it actually did."""
+
+    order  = np.lexsort((procs['stop'], procs['start'], procs['source']))
+    source = procs['source'][order]
+    start  = procs['start'][order].astype(float)
+    stop   = procs['stop'][order].astype(float)
+    if durations is None:
+        durations = stop - start
+    else:
+        durations = np.asarray(durations, dtype=float)[order]
+
+    n = len(order)
+    new_log = np.append(True, source[1:] != source[:-1])
+    bounds  = np.append(np.flatnonzero(new_log), n)
+
+    gaps = np.zeros(n)
+    gaps[1:] = start[1:] - stop[:-1]
+    gaps[new_log] = 0
+
+    new_start  = np.zeros(n)
+    new_stop   = np.zeros(n)
+    waited_for = np.zeros(len(bounds) - 1, dtype=int) - 1
+    done = np.zeros(n, dtype=bool)
+
+    # A step can only have waited for steps from logs that started
+    # before its own, so replaying the logs in order of their first
+    # step means everything a log waits for has been replayed already
+    for k in np.argsort(start[bounds[:-1]], kind='mergesort'):
+        (first, last) = bounds[k:k + 2]
+        t = start[first]
+        before = np.flatnonzero(done & (stop <= t))
+        if len(before):
+            lag = t - stop[before].max()
+            waited_for[k] = before[np.argmax(new_stop[before])]
+            t = new_stop[waited_for[k]] + lag
+        new_stop[first:last] = t + np.cumsum(gaps[first:last] +
+                                             durations[first:last])
+        new_start[first:last] = new_stop[first:last] - durations[first:last]
+        done[first:last] = True
+
+    return Schedule(order, bounds, new_start, new_stop, waited_for)
+
+def critical_path(schedule):
+
+    """Return the critical path through a Schedule, which is the chain
+of steps, each waiting for the one before it, that ends with the last
+step to finish. Speeding up a step that isn't on it can't make the job
+finish sooner. The path is returned as a list of (first, last)
+position ranges, one for each log file it goes through, in the order
+they ran."""
+
+    path = []
+    i = np.argmax(schedule.stop)
+    while i >= 0:
+        k = np.searchsorted(schedule.bounds, i, 'right') - 1
+        path.append((schedule.bounds[k], i + 1))
+        i = schedule.waited_for[k]
+    return path[::-1]
+
+def report_step_name(step):
+
+    """Return the name the report shows for step, which may be the name
+from the logs or one that steps are renamed to already."""
+
+    if step in step_mapping.values():
+        return step
+    return new_step_name(step)
+
+def merge_speedups(speedups):
+
+    """Return the (step, factor) pairs speedups with each step renamed
+by report_step_name and the factors for steps that end up with the same
+name multiplied together, in the order the steps first appear."""
+
+    factors = {}
+    steps = []
+    for (step, factor) in speedups:
+        step = report_step_name(step)
+        if step not in factors:
+            factors[step] = 1.
+            steps.append(step)
+        factors[step] *= factor
+    return [(s, factors[s]) for s in steps]
+
+def scaled_durations(procs, speedups):
+
+    """Return the duration of each of procs if the steps in speedups, a
+list of (step, factor) pairs, ran factor times faster. Steps are
+matched after renaming, with report_step_name."""
+
+    codes = renamed_step_codes()[procs['step']]
+    factors = np.ones(len(step_names.strings))
+    for (step, factor) in speedups:
+        code = step_names.index.get(report_step_name(step))
+        if code is not None:
+            factors[code] *= factor
+    return (procs['stop'] - procs['start']) / factors[codes]
+
+def job_span(schedule):
+    return schedule.stop.max() - schedule.start.min()
+
+def what_if_table(procs, scenarios):
+
+    """Return a table with the projected wallclock and CPU time for the
+job in procs under each of scenarios, a list of (label, speedups)
+pairs where speedups is as for scaled_durations."""
+
+    table = np.zeros(len(scenarios), dtype=[
+            ('label', 'S200'),
+            ('wallclock', float),
+            ('cpu', float)])
+    for (i, (label, speedups)) in enumerate(scenarios):
+        durations = scaled_durations(procs, speedups)
+        table['label'][i]     = label
+        table['wallclock'][i] = job_span(replay_schedule(procs, durations))
+        table['cpu'][i]       = durations.sum()
+    return table
+
+def unique_job_names(jobs):
+
+    """Return the names of the jobs in the (job_name, dir) pairs jobs,
+in the order they first appear."""
+
+    names = []
+    for (job_name, dir) in jobs:
+        if job_name not in names:
+            names.append(job_name)
+    return names
+
+# A QuantileSketch keeps up to this many times exactly, and after that
+# counts them in buckets whose bounds are within sketch_accuracy of
+# each other, relative to their size
+sketch_exact_values = 10000
+sketch_accuracy     = 0.005
+
+class QuantileSketch(object):
+
+    """Summarizes a stream of non-negative times in bounded memory, for
+    step_stats.
+
+    The first sketch_exact_values times are kept as they are, so a
+    sketch of fewer times gives exactly the same percentiles as
+    step_stats does. After that the times are counted in buckets that
+    grow geometrically, and a percentile is off by at most
+    sketch_accuracy of its value. The count, sum, min, and max are
+    always exact. Sketches can be merged, and a merged sketch is the
+    same as one that saw all the times.
+    """
+
+    gamma = (1 + sketch_accuracy) / (1 - sketch_accuracy)
+
+    def __init__(self):
+        self.values  = []
+        self.buckets = None
+        self.zeros   = 0
+        self.count   = 0
+        self.sum     = 0.0
+        self.min     = None
+        self.max     = None
+
+    def add(self, t):
+        self.add_many(np.array([t], dtype=float))
+
+    def add_many(self, times):
+
+        """Add each of an array of times."""
+
+        if not len(times):
+            return
+        self.count += len(times)
+        self.sum   += times.sum()
+        (lo, hi) = (times.min(), times.max())
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+        if self.buckets is None:
+            self.values.extend(times.tolist())
+            if len(self.values) > sketch_exact_values:
+                self.use_buckets()
+        else:
+            self.add_to_buckets(times)
+
+    def add_to_buckets(self, times, counts=None):
+
+        """Count times, each counts times if given, in the buckets."""
+
+        if counts is None:
+            counts = np.ones(len(times), dtype=int)
+        zero = times <= 0
+        self.zeros += counts[zero].sum()
+        keys = np.ceil(np.log(times[~zero]) / math.log(self.gamma)).astype(int)
+        (keys, index) = np.unique(keys, return_inverse=True)
+        sums = np.bincount(index, weights=counts[~zero]).astype(int)
+        for (key, n) in zip(keys, sums):
+            self.buckets[key] = self.buckets.get(key, 0) + n
+
+    def use_buckets(self):
+        self.buckets = {}
+        self.add_to_buckets(np.array(self.values))
+        self.values = []
+
+    def bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def merge(self, other):
+
+        """Add the times other has seen to this sketch."""
+
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.sum   += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+        if self.buckets is None and other.buckets is None:
+            self.values.extend(other.values)
+            if len(self.values) > sketch_exact_values:
+                self.use_buckets()
+            return
+
+        if self.buckets is None:
+            self.use_buckets()
+        if other.buckets is None:
+            self.add_to_buckets(np.array(other.values))
+        else:
+            self.zeros += other.zeros
+            for (key, n) in other.buckets.items():
+                self.buckets[key] = self.buckets.get(key, 0) + n
+
+    def shift(self, delta):
+
+        """Add delta to every time seen so far. Times that have been
+        counted in buckets move from their bucket's value, which can add
+        up to sketch_accuracy more to the error."""
+
+        self.sum += delta * self.count
+        if self.count:
+            self.min += delta
+            self.max += delta
+        if self.buckets is None:
+            self.values = [t + delta for t in self.values]
+        else:
+            keys = sorted(self.buckets)
+            times = np.array([0.0] + [self.bucket_value(k) for k in keys])
+            counts = np.array([self.zeros] + [self.buckets[k] for k in keys])
+            (self.buckets, self.zeros) = ({}, 0)
+            self.add_to_buckets(times + delta, counts)
+
+    def ranked(self, ranks):
+
+        """Return the times at the given positions, counting from 0, in
+        sorted order."""
+
+        if self.buckets is None:
+            values = sorted(self.values)
+            return [values[r] for r in ranks]
+
+        keys = sorted(self.buckets)
+        ends = np.cumsum([self.zeros] + [self.buckets[k] for k in keys])
+        values = [0.0] + [self.bucket_value(k) for k in keys]
+        return [min(max(values[np.searchsorted(ends, r, 'right')], self.min),
+                    self.max)
+                for r in ranks]
+
+    def percentile(self, pct):
+
+        """Return the pct percentile, interpolated as step_stats does."""
+
+        pos  = (self.count - 1) * (pct / 100.)
+        lo   = int(math.floor(pos))
+        hi   = min(lo + 1, self.count - 1)
+        (t_lo, t_hi) = self.ranked([lo, hi])
+        return t_lo + (t_hi - t_lo) * (pos - lo)
+
+# Steps that step_mapping combines are added together chunk by chunk.
+# StreamingJob treats a chunk of a combined step as complete once one
+# of its parts has run this many more times.
+stream_chunk_lag = 16
+
+def combined_steps():
+
+    """Return the names that step_mapping gives to more than one step,
+counting a step that isn't renamed as being renamed to itself."""
+
+    parts = {}
+    for name in step_mapping.values():
+        parts[name] = parts.get(name, 0) + 1
+    return set(name for name in parts
+               if parts[name] + (name not in step_mapping) > 1)
+
+class StreamingJob(object):
+
+    """Aggregates the step times for one copy of a job from its procs as
+    they are read, keeping a bounded amount of state for each step.
+
+    The times are the ones chunk_times gives: the nth time for a step
+    after renaming is the sum of the nth times of the steps it is made
+    of. So each combined step keeps the chunks that its parts haven't
+    all reached yet, and passes the rest on to its QuantileSketch.
+
+    The first chunk of each step is held back until the end, because
+    step_mapping treats a step that only ran once differently:
+    rename_steps adds its time to every chunk of the step it is
+    renamed to, if that step has more than one chunk.
+    """
+
+    def __init__(self, job_name, path):
+        self.job_name   = job_name
+        self.path       = path
+        self.combined   = combined_steps()
+        self.order      = []
+        self.procs      = {}
+        self.first      = {}
+        self.chunks     = {}
+        self.sketches   = {}
+        self.log_starts = []
+        self.num_events = 0
+        self.num_procs  = 0
+
+    def add_times(self, step, times):
+
+        """Add the times of runs of step, in the order they finished."""
+
+        name = new_step_name(step)
+        if name not in self.sketches:
+            self.order.append(name)
+            self.first[name]    = []
+            self.sketches[name] = QuantileSketch()
+            if name in self.combined:
+                # The partial sums of the chunks from base on, and the
+                # most chunks any part has run
+                self.chunks[name] = [1, np.zeros(0), 1]
+
+        n = self.procs.get(step, 0)
+        self.procs[step] = n + len(times)
+        if n == 0:
+            self.first[name].append((step, times[0]))
+            (times, n) = (times[1:], 1)
+
+        if name not in self.combined:
+            self.sketches[name].add_many(times)
+            return
+
+        (base, sums, most) = self.chunks[name]
+        (start, stop) = (n - base, n - base + len(times))
+        if stop > len(sums):
+            sums = np.append(sums, np.zeros(stop - len(sums)))
+        sums[start:stop] += times
+        self.chunks[name] = [base, sums, max(most, n + len(times))]
+
+    def flush_chunks(self, lag):
+
+        """Pass the chunks of combined steps that are more than lag
+        chunks behind the furthest part on to the sketches."""
+
+        for (name, (base, sums, most)) in self.chunks.items():
+            done = max(most - lag - base, 0)
+            if done:
+                self.sketches[name].add_many(sums[:done])
+                self.chunks[name] = [base + done, sums[done:], most]
+
+    def add_log(self, scanner, f):
+
+        """Read the log file f with scanner a block at a time, matching
+        the START and FINISH events as they are read, and add the time
+        of each step that completes."""
+
+        log = step_names.code('log')
+        open_starts = np.zeros(0, dtype=event_dtype)
+
+        for events in scanner.scan_blocks(f):
+            is_log = events['step'] == log
+            for t in events['time'][is_log]:
+                # Keep the two earliest, for the pre-processing step
+                self.log_starts.append((t, len(self.log_starts)))
+                self.log_starts = sorted(self.log_starts)[:2]
+
+            (procs, open_starts) = match_events(
+                concat_events([open_starts, events[~is_log]]))
+            self.num_events += len(events)
+            self.num_procs  += len(procs)
+
+            times = (procs['stop'] - procs['start']).astype(float)
+            (codes, first) = np.unique(procs['step'], return_index=True)
+            for code in codes[np.argsort(first, kind='mergesort')]:
+                self.add_times(step_names.strings[code],
+                               times[procs['step'] == code])
+            self.flush_chunks(stream_chunk_lag)
+
+    def finish(self):
+
+        """Add the pre-processing step, which runs from the first log
+        starting to the second one, as infer_preproc_from_events does,
+        and pass all the remaining chunks to the sketches."""
+
+        if len(self.log_starts) < 2:
+            raise Exception("%s needs at least two logs to infer the "
+                            "pre-processing time" % self.path)
+        ((start, i), (stop, j)) = self.log_starts
+        self.add_times('Pre-processing', np.array([stop - start], dtype=float))
+        self.order.remove('Pre-processing')
+        self.order.insert(0, 'Pre-processing')
+        self.flush_chunks(0)
+
+        for name in self.order:
+            sketch = self.sketches[name]
+            first = self.first.pop(name)
+            if max(self.procs[step] for (step, t) in first) == 1:
+                sketch.add(sum(t for (step, t) in first))
+                continue
+            kept   = [t for (step, t) in first if self.procs[step] > 1]
+            spread = [t for (step, t) in first if self.procs[step] == 1]
+            sketch.add(sum(kept))
+            if spread:
+                sketch.shift(sum(spread))
+
+    def step_stats(self):
+
+        """Return a table like step_stats gives for chunk_times of the
+        job's procs, with the steps in the order they were first seen."""
+
+        table = np.zeros(len(self.order), dtype=
+                         [('step', np.int32),
+                          ('count', int),
+                          ('sum', float),
+                          ('min', float)] +
+                         [(name, float) for (name, pct) in stat_percentiles] +
+                         [('max', float),
+                          ('straggler', float)])
+        for (row, name) in zip(table, self.order):
+            sketch = self.sketches[name]
+            row['step']  = step_names.code(name)
+            row['count'] = sketch.count
+            row['sum']   = sketch.sum
+            row['min']   = sketch.min
+            row['max']   = sketch.max
+            for (col, pct) in stat_percentiles:
+                row[col] = sketch.percentile(pct)
+
+        median = table['median']
+        table['straggler'] = table['max'] / np.where(median > 0, median, np.nan)
+        return table
+
+    def step_table(self):
+
+        """Return the table procs_to_array gives for the job's procs."""
+
+        stats = self.step_stats()
+        table = np.zeros(len(stats), dtype=step_table_dtype)
+        table['step']   = step_names.lookup(stats['step'])
+        table['chunks'] = stats['count']
+        table['total']  = stats['sum']
+        table['max']    = stats['max']
+        return table
+
+def stream_job(args):
+
+    """Read the log files for one copy of a job into a StreamingJob.
+Takes a (job_name, dir, log_files) tuple, so it can be run in a
+worker, and returns the finished StreamingJob, which refers to steps
+by name rather than code, along with the scan_counts for the job."""
+
+    (job_name, dir, log_files) = args
+    before = dict(scan_counts)
+    job = StreamingJob(job_name, dir)
+
+    for filename in log_files:
+        if log_archive_pat.match(os.path.basename(filename)):
+            with tarfile.open(filename, 'r|*') as tar:
+                for member in tar:
+                    if (member.isfile() and
+                        log_file_pat.match(os.path.basename(member.name))):
+                        source = '%s:%s' % (filename, member.name)
+                        job.add_log(LogScanner(source, job_name),
+                                    tar.extractfile(member))
+        else:
+            with open_log(filename) as f:
+                job.add_log(LogScanner(filename, job_name), f)
+
+    job.finish()
+    counts = dict((k, scan_counts[k] - before[k]) for k in scan_counts)
+    return (job, counts)
+
+def stream_jobs(jobs, job_log_files, num_workers):
+
+    """Return a finished StreamingJob for each of the (job_name, dir)
+pairs, reading the files in job_log_files for each job once, in
+bounded memory. With more than one worker, the jobs are read in
+parallel by a pool of num_workers processes."""
+
+    tasks = [(job_name, dir, log_files)
+             for ((job_name, dir), log_files) in zip(jobs, job_log_files)]
+
+    if num_workers <= 1:
+        return [stream_job(task)[0] for task in tasks]
+
+    # Only needed with more than one worker, so it isn't imported at
+    # startup
+    import multiprocessing
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        results = pool.map(stream_job, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    for (job, counts) in results:
+        for k in counts:
+            scan_counts[k] += counts[k]
+    return [job for (job, counts) in results]
+
+def merge_job_stats(jobs, stats, align=False):
+
+    """Merge the copies of each job in stats, which maps job name to a
+list of tables from procs_to_array. Returns a list of (job_name,
+table) pairs in the order the jobs were given. If align is True, the
+tables are first given a common set of steps with align_steps."""
+
+    tables = []
+
+    seen_job_name = set()
+    for (job_name, path) in jobs:
+        if job_name not in seen_job_name and job_name in stats:
+            seen_job_name.add(job_name)
+            copies = stats[job_name]
+            if align:
+                copies = align_steps(copies)
+            merged = merge_copies(copies)
+            tables.append((job_name, merged))
+
+    if align:
+        names = [name for (name, table) in tables]
+        tables = zip(names, align_steps([table for (name, table) in tables]))
+
+    return tables
+
+# The table merge_copies returns for a job. Besides the median chunks,
+# total, and max over the copies, it has the number of copies that ran
+# each step and, for total and max, the median absolute deviation and
+# the smallest and largest value over the copies.
+merged_table_dtype = np.dtype(
+    step_table_dtype.descr +
+    [('copies', int)] +
+    [('%s_%s' % (column, stat), float)
+     for column in ('total', 'max')
+     for stat in ('mad', 'min', 'max')])
+
+def stack_copies(copies):
+
+    """Align the given tables from procs_to_array by step name. Returns
+the steps in the order they were first seen and a dict mapping each
+of the chunks, total, and max columns to a (copies x steps) array,
+with NaN for the steps a copy doesn't have."""
+
+    which = np.repeat(np.arange(len(copies)), [len(c) for c in copies])
+
+    # Usually every copy ran the same steps
+    steps = copies[0]['step']
+    if all(np.array_equal(c['step'], steps) for c in copies):
+        column = np.tile(np.arange(len(steps)), len(copies))
+    else:
+        names = np.concatenate([c['step'] for c in copies])
+        (steps, first, index) = np.unique(names, return_index=True,
+                                          return_inverse=True)
+        order = np.argsort(first, kind='mergesort')
+        position = np.empty(len(order), dtype=int)
+        position[order] = np.arange(len(order))
+        column = position[index]
+        steps = steps[order]
+
+    stacked = {}
+    for name in ('chunks', 'total', 'max'):
+        values = np.empty((len(copies), len(steps)))
+        values.fill(np.nan)
+        values[which, column] = np.concatenate([c[name] for c in copies])
+        stacked[name] = values
+
+    return (steps, stacked)
+
+def column_medians(values):
+
+    """Return the median of each column of values, ignoring NaNs, which
+numpy.nanmedian does one column at a time. Every column must have at
+least one number."""
+
+    ordered = np.sort(values, axis=0)
+    counts  = (~np.isnan(values)).sum(axis=0)
+    columns = np.arange(values.shape[1])
+    return (ordered[(counts - 1) // 2, columns] +
+            ordered[counts // 2, columns]) / 2.
+
+def merge_copies(copies):
+
+    """Merge the tables from procs_to_array for several copies of a job
+into one, with the median chunks, total, and max for each step, along
+with their spread, as merged_table_dtype. Copies are matched up by
+step name, and a step that some copies didn't run is merged from the
+copies that did."""
+
+    print "--- Merging %d copies ---" % len(copies)
+
+    (steps, stacked) = stack_copies(copies)
+    present = ~np.isnan(stacked['total'])
+
+    result = np.zeros(len(steps), dtype=merged_table_dtype)
+    result['step']   = steps
+    result['copies'] = present.sum(axis=0)
+    result['chunks'] = np.round(column_medians(stacked['chunks']))
+
+    for column in ('total', 'max'):
+        values = stacked[column]
+        median = column_medians(values)
+        result[column] = median
+        result[column + '_mad'] = column_medians(np.abs(values - median))
+        result[column + '_min'] = np.nanmin(values, axis=0)
+        result[column + '_max'] = np.nanmax(values, axis=0)
+
+    for i in np.flatnonzero(result['copies'] < len(copies)):
+        print "Step %s is missing from %d of %d copies" % (
+            steps[i], len(copies) - result['copies'][i], len(copies))
+
+    return result
+
+def align_steps(tables):
+
+    """Given a list of tables from procs_to_array, return copies of them
+that all have the same steps in the same order, the order in which the
+steps were first seen. Steps missing from a table get zero chunks and
+zero times."""
+
+    steps = []
+    seen_steps = set()
+    for table in tables:
+        for step in table['step']:
+            if step not in seen_steps:
+                seen_steps.add(step)
+                steps.append(step)
+
+    index = dict((step, i) for (i, step) in enumerate(steps))
+
+    result = []
+    for table in tables:
+        aligned = np.zeros(len(steps), dtype=table.dtype)
+        aligned['step'] = steps
+        for row in table:
+            aligned[index[row['step']]] = row
+        result.append(aligned)
+    return result
+
+# The column of the procs_to_array table that each metric comes from
+metric_columns = {
+    'cpu' : 'total',
+    'wc'  : 'max',
+}
+
+def final_table_dtype(job_names):
+
+    """Return the dtype of the table make_final_table builds for the
+given jobs, the first of which is the baseline."""
+
+    fields = [('step', 'S100')]
+    for name in job_names:
+        fields.append(('%s_chunks' % name, int))
+        for metric in metric_columns:
+            fields.extend([
+                    ('%s_%s'           % (name, metric), float),
+                    ('%s_%s_pct'       % (name, metric), float),
+                    ('%s_%s_intensity' % (name, metric), float)])
+        if name != job_names[0]:
+            for metric in metric_columns:
+                fields.extend([
+                        ('%s_%s_gain'     % (name, metric), float),
+                        ('%s_%s_pct_gain' % (name, metric), float)])
+    return np.dtype(fields)
+
+def make_final_table(jobs):
+
+    """Given a list of (job_name, table) pairs, where each table comes
+from merge_copies and all tables have the same steps, return one wide
+table with the times, percentages, highlight intensities, and gains
+relative to the first job for every job and metric."""
+
+    job_names = [name for (name, table) in jobs]
+
+    result = np.zeros(len(jobs[0][1]), dtype=final_table_dtype(job_names))
+    result['step'] = jobs[0][1]['step']
+
+    for (name, table) in jobs:
+
+        result['%s_chunks' % name] = table['chunks']
+
+        for (metric, column) in metric_columns.items():
+            times = table[column]
+            intensity = (times - times.min()) / (times.max() - times.min())
+
+            result['%s_%s'           % (name, metric)] = times
+            result['%s_%s_pct'       % (name, metric)] = 100 * times / times.sum()
+            result['%s_%s_intensity' % (name, metric)] = 255 - (intensity * 255)
+
+    calc_gain(result, job_names)
+    return result
+
+def calc_gain(table, job_names):
+
+    """Fill in the gain columns of the given final table, comparing each
+job to the first one."""
+
+    for metric in metric_columns:
+        baseline_secs = table['%s_%s' % (job_names[0], metric)]
+
+        for name in job_names[1:]:
+            gain = baseline_secs - table['%s_%s' % (name, metric)]
+            table['%s_%s_gain' % (name, metric)] = gain
+            table['%s_%s_pct_gain' % (name, metric)] = (
+                100. * (gain / baseline_secs.sum()))
+
+def final_table_jobs(table):
+
+    """Return the names of the jobs in a final table, baseline first."""
+
+    return [name[:-len('_chunks')] for name in table.dtype.names
+            if name.endswith('_chunks')]
+
+def find_regressions(table, max_hours=None, max_pct=None):
+
+    """Return a list of (job, metric, step, hours, pct) for each step of
+each job in the final table that is slower than the baseline by more
+than max_hours hours or max_pct percent. Either limit may be None to not
+check it. The whole job is checked too, as the step 'Totals'.
+
+The percentage for a step is of that step's own time in the baseline,
+so a step that takes twice as long is 100% slower. For 'Totals' it is
+of the baseline job's total time. A step missing from the baseline is
+infinitely slower if it takes any time at all."""
+
+    jobs = final_table_jobs(table)
+    if len(jobs) < 2:
+        raise Exception("Checking for regressions needs a baseline job and "
+                        "at least one more job to compare to it")
+
+    regressions = []
+    for name in jobs[1:]:
+        for metric in sorted(metric_columns):
+            baseline_secs = table['%s_%s' % (jobs[0], metric)]
+            losses = -table['%s_%s_gain' % (name, metric)]
+            rows = zip(table['step'], losses, baseline_secs)
+            rows.append(('Totals', losses.sum(), baseline_secs.sum()))
+            for (step, loss, secs) in rows:
+                hours = loss / seconds_per_hour
+                if secs > 0:
+                    pct = 100. * loss / secs
+                else:
+                    pct = float('inf') if loss > 0 else 0.
+                if ((max_hours is not None and hours > max_hours) or
+                    (max_pct is not None and pct > max_pct)):
+                    regressions.append((name, metric, step, hours, pct))
+    return regressions
+
+def missing_steps(steps, all_procs):
+
+    """Return the names in steps, after renaming with
+report_step_name, of the ones that aren't in any of all_procs."""
+
+    seen = set()
+    for procs in all_procs:
+        seen.update(step_names.lookup(first_seen_steps(procs)))
+    return [report_step_name(step) for step in steps
+            if report_step_name(step) not in seen]
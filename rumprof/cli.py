@@ -0,0 +1,540 @@
+"""The profile_jobs.py command line, which is main(argv), and the
+--watch and --serve modes built on the parsing, aggregation and
+rendering modules.
+"""
+
+import argparse
+import BaseHTTPServer
+import mimetypes
+import os
+import sys
+import time
+import urllib
+import urlparse
+
+import rumprof.parse
+import rumprof.render
+from rumprof.parse import (
+    time_fmt, scan_counts, log_parsers, concat_events, find_log_files,
+    parse_log_source, load_events_for_job, load_events_for_jobs,
+    procs_from_events, JobWatcher)
+from rumprof.aggregate import (
+    procs_to_array, merge_speedups, unique_job_names, sketch_exact_values,
+    stream_jobs, merge_job_stats, metric_columns, make_final_table,
+    final_table_jobs, find_regressions, missing_steps)
+from rumprof.render import (
+    SelfProfile, write_pages, install_assets, write_report,
+    print_help_page, export_formats, write_exports, metric_names,
+    print_tables, print_stats_page, print_timeline_page,
+    print_critical_path_page, print_stream_pages, stream_stage,
+    print_self_profile)
+
+def watch_jobs(jobs, interval, straggler_factor, what_if=(), speedup=2.0):
+
+    """Rewrite the report for the given (job_name, dir) pairs every
+interval seconds, until interrupted. Steps that haven't finished yet
+are counted as running until the time of the update."""
+
+    watchers = [JobWatcher(job_name, dir) for (job_name, dir) in jobs]
+
+    install_assets()
+    print_help_page()
+
+    while True:
+        now = int(time.time())
+        stamp = time.strftime(time_fmt, time.localtime(now))
+
+        stats = {}
+        job_procs = []
+        for w in watchers:
+            w.update()
+            procs = w.procs(now)
+            if len(procs):
+                stats.setdefault(w.job_name, []).append(procs_to_array(procs))
+                job_procs.append((w.job_name, w.path, procs))
+
+        try:
+            write_report(merge_job_stats(jobs, stats, align=True))
+            print_stats_page(job_procs, straggler_factor)
+            print_timeline_page(job_procs)
+            print_critical_path_page(job_procs, what_if, speedup)
+            print "%s: updated report" % stamp
+        except Exception as e:
+            print "%s: couldn't update report: %s" % (stamp, e)
+
+        time.sleep(interval)
+
+class ReportServer(object):
+
+    """Keeps the timings for every copy of every job in memory for
+    --serve, and writes report pages for any choice of jobs from them.
+
+    refresh() looks for new and changed log files, going by their size
+    and modification time, and parses only those. The procs and the
+    procs_to_array table of each copy are kept, so a page for a
+    different baseline or set of jobs only needs the tables merged and
+    the page written, not the logs parsed again.
+    """
+
+    def __init__(self, jobs, scanner, straggler_factor, what_if=(),
+                 speedup=2.0):
+        self.jobs             = jobs
+        self.scanner          = scanner
+        self.straggler_factor = straggler_factor
+        self.what_if          = what_if
+        self.speedup          = speedup
+        self.job_names        = unique_job_names(jobs)
+        self.file_events      = {}
+        self.procs            = [None] * len(jobs)
+        self.tables           = [None] * len(jobs)
+        self.version          = 0
+        self.written          = {}
+        self.last_refresh     = None
+
+    def refresh(self, min_interval=0):
+
+        """Parse any log files that are new or have changed since the
+last call, unless the last call was less than min_interval seconds
+ago. Returns True if any copy's timings changed."""
+
+        now = time.time()
+        if (self.last_refresh is not None and
+            now - self.last_refresh < min_interval):
+            return False
+        self.last_refresh = now
+
+        changed = False
+        for (i, (job_name, dir)) in enumerate(self.jobs):
+            copy_changed = False
+            log_events = []
+            for filename in find_log_files(dir):
+                st = os.stat(filename)
+                signature = (st.st_size, st.st_mtime)
+                cached = self.file_events.get(filename)
+                if cached is None or cached[0] != signature:
+                    events = parse_log_source(filename, job_name, self.scanner)
+                    cached = self.file_events[filename] = (signature, events)
+                    copy_changed = True
+                log_events.append(cached[1])
+
+            if copy_changed:
+                procs = procs_from_events(concat_events(log_events))
+                self.procs[i]  = procs
+                self.tables[i] = procs_to_array(procs)
+                changed = True
+
+        if changed:
+            self.version += 1
+        return changed
+
+    def select(self, baseline=None, compare=None):
+
+        """Return the names of the given baseline job and the list of
+jobs to compare to it, baseline first. baseline defaults to the first
+job given on the command line, and compare to all the others."""
+
+        if baseline is None:
+            baseline = self.job_names[0]
+        if compare is None:
+            compare = self.job_names
+        for name in [baseline] + compare:
+            if name not in self.job_names:
+                raise Exception("There is no job called %s" % name)
+
+        return [baseline] + [n for n in compare if n != baseline]
+
+    def write_page(self, page, baseline=None, compare=None, nav_query=''):
+
+        """Write the page with the given name to output_dir for the
+selected jobs, unless it's already there for the same jobs and
+timings. page is one of the names in pages, or final_table.FORMAT for
+one of the export_formats. nav_query is added to the links in the
+page's navigation bar."""
+
+        names = self.select(baseline, compare)
+
+        # Every selection is written to the same file, so remember which
+        # one is on disk for each page
+        written = ((tuple(names), nav_query), self.version)
+        if self.written.get(page) == written:
+            return
+
+        jobs = []
+        stats = {}
+        job_procs = []
+        for name in names:
+            for (i, (job_name, dir)) in enumerate(self.jobs):
+                if job_name == name and self.procs[i] is not None:
+                    jobs.append((job_name, dir))
+                    stats.setdefault(job_name, []).append(self.tables[i])
+                    job_procs.append((job_name, dir, self.procs[i]))
+
+        if page in ('cpu', 'wc') or page.startswith('final_table.'):
+            table = make_final_table(merge_job_stats(jobs, stats))
+            if page.startswith('final_table.'):
+                write_exports(table, [page.split('.', 1)[1]])
+            else:
+                print_tables(table, final_table_jobs(table), ['cpu', 'wc'],
+                             nav_query)
+                self.written['cpu'] = self.written['wc'] = written
+        elif page == 'stats':
+            print_stats_page(job_procs, self.straggler_factor, nav_query)
+        elif page == 'timeline':
+            print_timeline_page(job_procs, nav_query)
+        elif page == 'critical':
+            print_critical_path_page(job_procs, self.what_if, self.speedup,
+                                     nav_query)
+        elif page == 'help':
+            print_help_page(nav_query)
+        else:
+            raise Exception("There is no page called %s" % page)
+        self.written[page] = written
+
+# Query parameters for the pages --serve serves, which are carried over
+# to the links in the navigation bar
+serve_params = ['baseline', 'jobs', 'metric']
+
+class ReportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """Serves the report pages from output_dir, writing each page from
+the ReportServer in self.server.report before it's sent. Takes these
+query parameters:
+
+    baseline  the job to compare the others to
+    jobs      comma-separated jobs to compare to it
+    metric    cpu or wc, for which table / shows
+    """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        path = urlparse.unquote(url.path).lstrip('/')
+
+        def param(name):
+            values = query.get(name)
+            return values[-1] if values else None
+
+        nav_query = urllib.urlencode(
+            [(name, param(name)) for name in serve_params
+             if param(name) is not None])
+        if nav_query:
+            nav_query = '?' + nav_query
+
+        report = self.server.report
+        try:
+            if path in ('', 'index.html'):
+                metric = param('metric') or 'cpu'
+                if metric not in metric_columns:
+                    raise Exception("The metric should be one of %s" %
+                                    ', '.join(sorted(metric_columns)))
+                path = '%s.html' % metric
+
+            (page, ext) = os.path.splitext(path)
+            is_export = (page == 'final_table' and
+                         ext.lstrip('.') in export_formats)
+            if ext == '.html' or is_export:
+                start = time.time()
+                report.refresh(self.server.poll_interval)
+                compare = param('jobs')
+                report.write_page(path if is_export else page,
+                                  param('baseline'),
+                                  compare.split(',') if compare else None,
+                                  nav_query)
+                self.log_message('wrote %s in %.1f ms', path,
+                                 1000 * (time.time() - start))
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+
+        output_dir = rumprof.render.output_dir
+        root = os.path.realpath(output_dir)
+        filename = os.path.realpath(os.path.join(output_dir, path))
+        if (not filename.startswith(root + os.sep) or
+            not os.path.isfile(filename)):
+            self.send_error(404)
+            return
+
+        with open(filename, 'rb') as f:
+            contents = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(filename)[0] or
+                         'application/octet-stream')
+        self.send_header('Content-Length', str(len(contents)))
+        self.end_headers()
+        self.wfile.write(contents)
+
+def serve_report(jobs, port, scanner, straggler_factor, poll_interval,
+                 what_if=(), speedup=2.0):
+
+    """Serve the report for the given (job_name, dir) pairs on
+localhost:port until interrupted, parsing the logs once up front and
+then only the log files that change, at most every poll_interval
+seconds."""
+
+    report = ReportServer(jobs, scanner, straggler_factor, what_if, speedup)
+    install_assets()
+    report.refresh()
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', port),
+                                       ReportRequestHandler)
+    server.report = report
+    server.poll_interval = poll_interval
+    print "Serving the report at http://127.0.0.1:%d/" % port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+def parse_speedup(arg):
+
+    """Parse a --what-if argument into a (step, factor) pair."""
+
+    (step, sep, factor) = arg.rpartition('=')
+    try:
+        factor = float(factor)
+    except ValueError:
+        factor = None
+    if not step or factor is None or factor <= 0:
+        raise argparse.ArgumentTypeError(
+            "%r should be STEP=X, with X a positive number" % arg)
+    return (step, factor)
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Profile the running times of one or more RUM jobs")
+    parser.add_argument(
+        'job_dirs', nargs='+', metavar='NAME=DIR',
+        help="""Job name and the directory containing its logs. Give
+        the same name more than once to group copies of a job.""")
+    parser.add_argument(
+        '--jobs', '-j', dest='num_workers', type=int, default=1,
+        metavar='N',
+        help="Number of processes to use for parsing log files")
+    parser.add_argument(
+        '--scanner', choices=sorted(log_parsers), default='cached',
+        help="""Log parser to use. 'regex' runs the full regex and
+        strptime on every line; 'fast' skips lines that can't be
+        workflow events and caches parsed timestamps; 'cached' (the
+        default) is 'fast' plus an on-disk cache of parsed events in
+        %s/, so unchanged logs aren't parsed again and logs that have
+        grown are only parsed from where they left off.""" % rumprof.parse.cache_dir)
+    parser.add_argument(
+        '--watch', type=float, metavar='SECONDS',
+        help="""Follow the logs of running jobs and rewrite the report
+        every SECONDS seconds, counting unfinished steps as running
+        until the time of the update. Only new log lines are read on
+        each update. --jobs and --scanner are ignored.""")
+    parser.add_argument(
+        '--serve', type=int, metavar='PORT',
+        help="""Serve the report on http://127.0.0.1:PORT/ instead of
+writing it once. The logs are parsed once and kept in memory, and only
+log files that have changed are parsed again, checking at most every 2
+seconds or every --watch SECONDS. Pages take the query parameters
+baseline=JOB, jobs=JOB,JOB,... for the jobs to compare to it, and
+metric=cpu or wc for the table shown at /. The final table can be
+fetched as final_table.json, .csv or .npz with the same parameters.""")
+    parser.add_argument(
+        '--stream', action='store_true',
+        help="""Read each log once, a block at a time, keeping only a
+        fixed amount of state per step rather than every event, so
+        that memory use doesn't grow with the size of the logs.
+        Percentiles are estimated once a step has more than %d chunks,
+        and the report leaves out stragglers and concurrency.
+        --scanner is ignored.""" % sketch_exact_values)
+    parser.add_argument(
+        '--straggler-factor', type=float, default=2.0, metavar='X',
+        help="""List chunks that took more than X times the median time
+        for a step as stragglers (default %(default)s)""")
+    parser.add_argument(
+        '--what-if', action='append', type=parse_speedup, default=[],
+        metavar='STEP=X',
+        help="""Show on the critical path page how long each job would
+take if STEP ran X times faster. STEP can be the name shown in the
+report or the one in the logs, which speeds up every step shown under
+the same name. Given more than once, each step is shown on its own and
+then all of them together, with the factors for the same step
+multiplied. Unless --watch or --serve is given, every STEP must be in at
+least one of the jobs.""")
+    parser.add_argument(
+        '--speedup', type=float, default=2.0, metavar='X',
+        help="""Also show on the critical path page how long each job
+would take with each step on its own running X times faster (default
+%(default)s)""")
+    parser.add_argument(
+        '--export', action='append', choices=export_formats, default=[],
+        help="""Also write the final table, with times in seconds, to
+%s/final_table.FORMAT. May be given more than once. Ignored with
+--watch.""" % rumprof.render.output_dir)
+    parser.add_argument(
+        '--max-slowdown-hours', type=float, metavar='H',
+        help="""Exit with status 1 if the CPU or wallclock time of any
+step, or of the whole job, is more than H hours slower than the
+baseline in any of the other jobs. Ignored with --watch.""")
+    parser.add_argument(
+        '--max-slowdown-pct', type=float, metavar='P',
+        help="""Exit with status 1 if the CPU or wallclock time of any
+step, or of the whole job, is more than P percent slower than it is in
+the baseline, in any of the other jobs. Each step is compared to its
+own time in the baseline, so P=15 catches a step that got 15%% slower
+however small it is. Ignored with --watch.""")
+    parser.add_argument(
+        '--self-profile', action='store_true',
+        help="""Time each stage of this program and count the lines,
+        events, and procs it handles, and write the results to
+        %s/self_profile.json and self_profile.html. Ignored with
+        --watch.""" % rumprof.render.output_dir)
+    return parser
+
+def parse_args(argv):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    args.what_if = merge_speedups(args.what_if)
+
+    if args.max_slowdown_hours is not None or args.max_slowdown_pct is not None:
+        names = set(arg.split('=')[0] for arg in args.job_dirs)
+        if len(names) < 2:
+            parser.error("--max-slowdown-hours and --max-slowdown-pct need a "
+                         "baseline job and at least one more job to compare "
+                         "to it")
+    return args
+
+def main(argv=None):
+
+    """Run profile_jobs.py with the given command line arguments, which
+default to sys.argv[1:]. Returns the exit status."""
+
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    jobs = []
+
+    for arg in args.job_dirs:
+        
+        (job_name, dir) = arg.split("=")
+        jobs.append((job_name, dir))
+
+    if args.serve is not None:
+        serve_report(jobs, args.serve, args.scanner, args.straggler_factor,
+                     2.0 if args.watch is None else args.watch,
+                     args.what_if, args.speedup)
+        return 0
+
+    if args.watch is not None:
+        watch_jobs(jobs, args.watch, args.straggler_factor,
+                   args.what_if, args.speedup)
+        return 0
+
+    rumprof.parse.count_lines = args.self_profile
+    profile = SelfProfile()
+
+    with profile.stage('find_log_files'):
+        job_log_files = [find_log_files(dir) for (job_name, dir) in jobs]
+
+    if args.stream:
+        table = stream_report(jobs, job_log_files, args.num_workers, profile)
+        if check_final_table(table, args.export, args.max_slowdown_hours,
+                             args.max_slowdown_pct):
+            return 1
+        return 0
+
+    with profile.stage('parse_logs'):
+        if args.num_workers > 1:
+            job_events = load_events_for_jobs(jobs, args.num_workers,
+                                              args.scanner, job_log_files)
+        else:
+            job_events = [load_events_for_job(dir, job_name, args.scanner,
+                                              log_files)
+                          for ((job_name, dir), log_files)
+                          in zip(jobs, job_log_files)]
+
+    stats = {}
+    job_procs = []
+
+    with profile.stage('build_timings'):
+        for ((job_name, dir), events) in zip(jobs, job_events):
+            job_procs.append((job_name, dir, procs_from_events(events)))
+
+    missing = missing_steps([step for (step, factor) in args.what_if],
+                            [procs for (job_name, dir, procs) in job_procs])
+    if missing:
+        make_parser().error("--what-if step %s isn't in any of the jobs" %
+                            ', '.join(missing))
+
+    with profile.stage('procs_to_array'):
+        for (job_name, dir, procs) in job_procs:
+            job_stats = procs_to_array(procs)
+            if job_name not in stats:
+                stats[job_name] = []
+            stats[job_name].append(job_stats)
+
+    with profile.stage('merge_copies'):
+        tables = merge_job_stats(jobs, stats)
+
+    table = write_pages(tables, job_procs, args.straggler_factor, profile,
+                        args.what_if, args.speedup)
+
+    if args.self_profile:
+        profile.counts.update(scan_counts)
+        profile.counts['log_files'] = sum(map(len, job_log_files))
+        profile.counts['events']    = sum(map(len, job_events))
+        profile.counts['procs']     = sum(len(p) for (n, d, p) in job_procs)
+        profile.counts['steps']     = sum(len(t) for (n, t) in tables)
+        print_self_profile(profile)
+
+    if check_final_table(table, args.export, args.max_slowdown_hours,
+                         args.max_slowdown_pct):
+        return 1
+    return 0
+
+def stream_report(jobs, job_log_files, num_workers, profile):
+
+    """Write the report for --stream, given the log files for each of
+the (job_name, dir) pairs, and return the final table."""
+
+    with profile.stage(stream_stage):
+        streaming = stream_jobs(jobs, job_log_files, num_workers)
+
+    stats = {}
+    for job in streaming:
+        stats.setdefault(job.job_name, []).append(job.step_table())
+
+    with profile.stage('merge_copies'):
+        tables = merge_job_stats(jobs, stats)
+
+    with profile.stage('install_assets'):
+        install_assets()
+    with profile.stage('make_final_table'):
+        table = make_final_table(tables)
+    with profile.stage('print_tables'):
+        print_tables(table, [x[0] for x in tables], ['cpu', 'wc'])
+    with profile.stage('print_stream_pages'):
+        print_stream_pages(streaming)
+    with profile.stage('print_help_page'):
+        print_help_page()
+
+    if rumprof.parse.count_lines:
+        profile.counts.update(scan_counts)
+        profile.counts['log_files'] = sum(map(len, job_log_files))
+        profile.counts['events']    = sum(j.num_events for j in streaming)
+        profile.counts['procs']     = sum(j.num_procs for j in streaming)
+        profile.counts['steps']     = sum(len(t) for (n, t) in tables)
+        print_self_profile(profile)
+
+    return table
+
+def check_final_table(table, exports, max_hours, max_pct):
+
+    """Write the exports of the final table and check it for
+regressions, for the command line options. Prints any regressions and
+returns True if there were any."""
+
+    if exports:
+        write_exports(table, exports)
+    if max_hours is None and max_pct is None:
+        return False
+
+    regressions = find_regressions(table, max_hours, max_pct)
+    for (name, metric, step, hours, pct) in regressions:
+        print "REGRESSION: %s %s time for %s is %.2f hours (%.2f%%) slower than %s" % (
+            name, metric_names[metric], step, hours, pct,
+            final_table_jobs(table)[0])
+    return len(regressions) > 0
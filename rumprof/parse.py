@@ -0,0 +1,746 @@
+"""Parsing: finding the log files for a job, scanning them into arrays
+of events, and matching the events up into procs, with one row per step
+run. Scanned log files are cached in cache_dir.
+
+Steps, jobs, and log files are stored as codes into step_names,
+job_names, and source_names, which the other modules share.
+"""
+
+import bz2
+import gzip
+import hashlib
+import marshal
+import numpy as np
+import os
+import re
+import tarfile
+import time
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+cache_dir  = 'rum_profile_cache'
+
+START  = 0
+FINISH = 1
+event_types = ('START', 'FINISH')
+
+# Events and Procs are kept in numpy structured arrays. Times are epoch
+# seconds, and steps, jobs, and log files are stored as codes that
+# index into step_names, job_names, and source_names.
+event_dtype = np.dtype([
+        ('time',   np.int64),
+        ('type',   np.int8),
+        ('step',   np.int32),
+        ('job',    np.int32),
+        ('source', np.int32)])
+
+proc_dtype = np.dtype([
+        ('step',   np.int32),
+        ('start',  np.int64),
+        ('stop',   np.int64),
+        ('job',    np.int32),
+        ('source', np.int32)])
+
+class Names(object):
+
+    """Assigns a small integer code to each distinct string it sees."""
+
+    def __init__(self):
+        self.strings = []
+        self.index   = {}
+
+    def code(self, s):
+        c = self.index.get(s)
+        if c is None:
+            c = len(self.strings)
+            self.index[s] = c
+            self.strings.append(s)
+        return c
+
+    def codes(self, strings):
+        return np.array([self.code(s) for s in strings], dtype=np.int32)
+
+    def lookup(self, codes):
+        return [self.strings[c] for c in codes]
+
+step_names   = Names()
+job_names    = Names()
+source_names = Names()
+
+def make_events(times, types, steps, job_name, filename):
+
+    """Return an event array from lists of times, type codes and step
+codes that all came from the same log file."""
+
+    events = np.zeros(len(times), dtype=event_dtype)
+    events['time']   = times
+    events['type']   = types
+    events['step']   = steps
+    events['job']    = job_names.code(job_name)
+    events['source'] = source_names.code(filename)
+    return events
+
+def concat_events(arrays, dtype=event_dtype):
+    arrays = list(arrays)
+    if not arrays:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays)
+
+def make_proc(step, start, stop, job, source):
+    return np.array([(step_names.code(step), start, stop, job, source)],
+                    dtype=proc_dtype)
+
+step_mapping = {
+    'Run bowtie on genome'              : 'Run Bowtie on genome',
+    'Parse genome Bowtie output'        : 'Run Bowtie on genome',
+    'Run bowtie on transcriptome'       : 'Run Bowtie on transcriptome',
+    'Parse transcriptome Bowtie output' : 'Run Bowtie on transcriptome',
+    'Run blat on unmapped reads'        : 'Run BLAT',
+    'Parse blat output'                 : 'Run BLAT',
+    'Run mdust on unmapped reads'       : 'Run BLAT',
+    'Sort junctions (all, bed) by location' : 'Sort junctions',
+    'Sort junctions (all, rum) by location' : 'Sort junctions',
+    'Sort junctions (high-quality, bed) by location' : 'Sort junctions',
+    'Finish mapping stats'      : 'Other post-processing',
+    'Merge SAM headers'          : 'Other post-processing',
+    'Sort junctions'             : 'Other post-processing',
+    'Get inferred internal exons'             : 'Other post-processing',
+    'Merge quants'             : 'Other post-processing',
+    'Sort junctions'             : 'Other post-processing',
+    'Remove duplicates from NU' : 'Other processing',
+    'Make unmapped reads file for blat' : 'Other processing',
+    
+    }
+
+time_re  = "(\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2})"
+time_fmt = "%Y/%m/%d %H:%M:%S"
+time_pat     = re.compile(time_re)
+workflow_pat = re.compile(time_re + ".*RUM\.Workflow.*(START|FINISH)\s+(.*)")
+
+# Substring that every line matched by workflow_pat must contain. The
+# fast scanner only runs the regex on lines containing it.
+workflow_marker = 'RUM.Workflow'
+
+# Number of bytes LogScanner reads from a log file at a time.
+scan_block_size = 4 * 1024 * 1024
+
+# Work done by the log parsers in this process, reported by
+# --self-profile: lines and bytes read, and timestamps converted with
+# strptime and the time spent doing it. Counting lines costs about a
+# fifth of the fast scanner's time, so lines and bytes are only counted
+# when count_lines is set.
+count_lines = False
+
+scan_counts = {
+    'lines'            : 0,
+    'bytes'            : 0,
+    'timestamps'       : 0,
+    'strptime_seconds' : 0.0,
+}
+
+def parse_timestamp(tm):
+
+    """Return the epoch seconds for a log timestamp, counting the call
+in scan_counts."""
+
+    start = time.time()
+    t = int(time.mktime(time.strptime(tm, time_fmt)))
+    scan_counts['timestamps'] += 1
+    scan_counts['strptime_seconds'] += time.time() - start
+    return t
+
+# Number of distinct timestamps LogScanner remembers before starting
+# over. Log lines are written in time order, so this only needs to be
+# big enough to cover one block.
+max_cached_times = 4096
+
+# Log file names we look for in a job directory. Logs may be compressed.
+log_file_pat = re.compile("(rum_(postproc|\d+).*log|rum\.log)(\.(gz|bz2|xz))?$")
+
+# Name of a tar archive of a job's log directory
+log_archive_pat = re.compile("log\.(tar|tgz|tar\.gz|tar\.bz2)$")
+
+# Classes used to read compressed log files, by extension
+log_openers = {
+    '.gz'  : gzip.GzipFile,
+    '.bz2' : bz2.BZ2File,
+    '.xz'  : lzma.LZMAFile if lzma is not None else None,
+}
+
+def open_log(filename):
+
+    """Open a log file for reading in binary mode, decompressing it as it
+is read if it has a .gz, .bz2, or .xz extension."""
+
+    ext = os.path.splitext(filename)[1]
+    if ext not in log_openers:
+        return open(filename, 'rb')
+    if log_openers[ext] is None:
+        raise Exception(
+            "Can't read %s: reading .xz files needs the lzma module "
+            "(pip install backports.lzma)" % filename)
+    return log_openers[ext](filename, 'rb')
+
+def is_compressed(filename):
+    return os.path.splitext(filename)[1] in log_openers
+
+def parse_log_file(filename, job_name):
+
+    """Parse the specified log file and return an array of the events
+    in the file."""
+
+    first_time = None
+    times = []
+    types = []
+    steps = []
+    
+    with open_log(filename) as f:
+        for line in f:
+            if count_lines:
+                scan_counts['lines'] += 1
+                scan_counts['bytes'] += len(line)
+            if first_time is None:
+                m = time_pat.match(line)
+                if m is None:
+                    raise Exception("Couldn't parse time from " + line)
+                tm = m.group(1)
+                print "TM is " + str(tm)
+                first_time = time.strptime(tm, time_fmt)
+                print "First time is " + str(first_time)
+
+                times.append(int(time.mktime(first_time)))
+                types.append(START)
+                steps.append(step_names.code('log'))
+            m = workflow_pat.match(line)
+            if (m is not None):
+                (tm, type, step) = m.groups()
+                times.append(parse_timestamp(tm))
+                types.append(event_types.index(type))
+                steps.append(step_names.code(step))
+
+    return make_events(times, types, steps, job_name, filename)
+
+class LogScanner(object):
+
+    """Reads events from a log file in large binary blocks.
+
+    Produces the same events as parse_log_file, but only runs the
+    workflow regex on lines that contain workflow_marker, and converts
+    each distinct timestamp to epoch seconds only once. The scanner
+    remembers the byte offset just past the last complete line it has
+    read, so calling scan() again later only reads lines appended since
+    the last call.
+    """
+
+    def __init__(self, filename, job_name, offset=0):
+        self.filename = filename
+        self.job_name = job_name
+        self.offset   = offset
+        self.times    = {}
+
+    def parse_time(self, tm):
+        t = self.times.get(tm)
+        if t is None:
+            if len(self.times) >= max_cached_times:
+                self.times.clear()
+            t = parse_timestamp(tm)
+            self.times[tm] = t
+        return t
+
+    def scan(self, final=True):
+
+        """Return an array of the events in the lines appended to the
+        file since the last call. If final is False, a trailing line
+        with no newline is assumed to be still in the middle of being
+        written and is left for the next call."""
+
+        with open_log(self.filename) as f:
+            if self.offset:
+                f.seek(self.offset)
+            return self.scan_file(f, final)
+
+    def scan_file(self, f, final=True):
+
+        """Like scan, but reads from the file object f, which should be
+        positioned at self.offset."""
+
+        events = list(self.scan_blocks(f, final))
+        if not events:
+            return make_events([], [], [], self.job_name, self.filename)
+        return concat_events(events)
+
+    def scan_blocks(self, f, final=True):
+
+        """Like scan_file, but yield the events one block of the file at a
+        time, so that a file of any size can be read in bounded memory."""
+
+        tail = ''
+        while True:
+            block = f.read(scan_block_size)
+            if not block:
+                break
+            block = tail + block
+            end = block.rfind('\n') + 1
+            columns = ([], [], [])
+            self.scan_lines(block, end, columns)
+            self.offset += end
+            tail = block[end:]
+            yield make_events(*(columns + (self.job_name, self.filename)))
+
+        if tail and final:
+            columns = ([], [], [])
+            self.scan_lines(tail, len(tail), columns)
+            self.offset += len(tail)
+            yield make_events(*(columns + (self.job_name, self.filename)))
+
+    def scan_lines(self, block, end, columns):
+
+        """Append the times, type codes and step codes of the events in
+        block[:end] to the three lists in columns."""
+
+        if end == 0:
+            return
+
+        (times, types, steps) = columns
+        if count_lines:
+            scan_counts['lines'] += block.count('\n', 0, end) or 1
+            scan_counts['bytes'] += end
+
+        if self.offset == 0:
+            m = time_pat.match(block, 0, end)
+            if m is None:
+                first_line = block[:block.find('\n', 0, end) + 1 or end]
+                raise Exception("Couldn't parse time from " + first_line)
+            times.append(self.parse_time(m.group(1)))
+            types.append(START)
+            steps.append(step_names.code('log'))
+
+        find = block.find
+        pos = 0
+        while True:
+            i = find(workflow_marker, pos, end)
+            if i < 0:
+                break
+            start = block.rfind('\n', 0, i) + 1
+            stop  = find('\n', i, end)
+            if stop < 0:
+                stop = end
+            pos = stop + 1
+
+            m = workflow_pat.match(block, start, stop)
+            if m is not None:
+                (tm, type, step) = m.groups()
+                times.append(self.parse_time(tm))
+                types.append(START if type == 'START' else FINISH)
+                steps.append(step_names.code(step))
+
+def scan_log_file(filename, job_name):
+
+    """Return the array of events in the specified log file, using
+    LogScanner."""
+
+    return LogScanner(filename, job_name).scan()
+
+def scan_log_archive(filename, job_name):
+
+    """Return the array of events in all the log files in the specified
+tar archive, using LogScanner. The archive is read as a stream, so it
+is only decompressed once. Each log's source is recorded as
+ARCHIVE:MEMBER."""
+
+    events = []
+    with tarfile.open(filename, 'r|*') as tar:
+        for member in tar:
+            if (member.isfile() and
+                log_file_pat.match(os.path.basename(member.name))):
+                source = '%s:%s' % (filename, member.name)
+                scanner = LogScanner(source, job_name)
+                events.append(scanner.scan_file(tar.extractfile(member)))
+    return concat_events(events)
+
+# Bump this whenever the layout of the cache files changes, so stale
+# caches are ignored rather than misread.
+cache_version = 2
+
+# The cache records a checksum of up to this many bytes from the start
+# of the log file, so that a file that was replaced by a larger one
+# isn't mistaken for one that was appended to.
+cache_head_bytes = 4096
+
+def cache_filename(filename):
+    key = hashlib.sha1(os.path.abspath(filename)).hexdigest()
+    return os.path.join(cache_dir, key)
+
+def head_checksum(filename, offset):
+    with open(filename, 'rb') as f:
+        return zlib.crc32(f.read(min(offset, cache_head_bytes)))
+
+def encode_events(events):
+
+    """Return a compact binary representation of the given events,
+leaving out the job and source. The time, type, and step columns are
+stored as raw arrays, with step codes replaced by indexes into a list
+of the names of the steps that occur in the file."""
+
+    (codes, steps) = np.unique(events['step'], return_inverse=True)
+    return (marshal.dumps(step_names.lookup(codes)),
+            events['time'].tostring(),
+            events['type'].tostring(),
+            steps.astype(np.int32).tostring())
+
+def decode_events(encoded, job_name, filename):
+    (names, times, types, steps) = encoded
+    codes = step_names.codes(marshal.loads(names))
+    return make_events(np.fromstring(times, dtype=np.int64),
+                       np.fromstring(types, dtype=np.int8),
+                       codes[np.fromstring(steps, dtype=np.int32)],
+                       job_name, filename)
+
+def read_cache(filename):
+
+    """Return the (size, mtime, offset, checksum, encoded_events) tuple
+cached for the given log file, or None if there is no usable cache."""
+
+    try:
+        with open(cache_filename(filename), 'rb') as f:
+            entry = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if entry[0] != cache_version or entry[1] != os.path.abspath(filename):
+        return None
+    return entry[2:]
+
+def write_cache(filename, size, mtime, offset, checksum, events):
+    if not os.path.isdir(cache_dir):
+        try:
+            os.mkdir(cache_dir)
+        except OSError:
+            # Another worker may have just created it
+            if not os.path.isdir(cache_dir):
+                raise
+    entry = (cache_version, os.path.abspath(filename),
+             size, mtime, offset, checksum, encode_events(events))
+    path = cache_filename(filename)
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        marshal.dump(entry, f)
+    os.rename(tmp, path)
+
+def cached_scan_log_file(filename, job_name):
+
+    """Return the array of events in the specified log file, using the
+cache in cache_dir where possible.
+
+If the file's size and mtime match the cache, the cached events are
+used as they are. If the file has grown since it was cached and its
+first few KB haven't changed, only the bytes after the last cached
+line are scanned. Otherwise the whole file is scanned. The cache only
+ever holds complete lines; a trailing line with no newline is always
+scanned fresh.
+
+Compressed logs are assumed not to change while they are being read,
+so they are always cached whole, since picking up from an offset
+would mean decompressing everything before it again."""
+
+    st = os.stat(filename)
+    entry = read_cache(filename)
+    compressed = is_compressed(filename)
+    events = None
+    scanner = None
+
+    if entry is not None:
+        (size, mtime, offset, checksum, encoded) = entry
+        if (size, mtime) == (st.st_size, st.st_mtime):
+            events = decode_events(encoded, job_name, filename)
+            if compressed:
+                return events
+            scanner = LogScanner(filename, job_name, offset)
+        elif (not compressed and st.st_size > size and
+              head_checksum(filename, offset) == checksum):
+            events = decode_events(encoded, job_name, filename)
+            scanner = LogScanner(filename, job_name, offset)
+            events = concat_events([events, scanner.scan(final=False)])
+            write_cache(filename, st.st_size, st.st_mtime, scanner.offset,
+                        head_checksum(filename, scanner.offset), events)
+
+    if scanner is None:
+        scanner = LogScanner(filename, job_name)
+        events = scanner.scan(final=compressed)
+        write_cache(filename, st.st_size, st.st_mtime, scanner.offset,
+                    head_checksum(filename, scanner.offset), events)
+        if compressed:
+            return events
+
+    return concat_events([events, scanner.scan()])
+
+# Functions that turn a (filename, job_name) into an event array,
+# selected with --scanner.
+log_parsers = {
+    'cached' : cached_scan_log_file,
+    'fast'   : scan_log_file,
+    'regex'  : parse_log_file,
+}
+
+def match_events(events):
+
+    """Match each START event to its corresponding FINISH event, as if
+the events were pushed onto and popped off a stack in order. Returns
+an array of procs in the order of their FINISH events, and an array of
+the START events that were never matched, in their original order."""
+
+    is_start = events['type'] == START
+    depth = np.cumsum(np.where(is_start, 1, -1))
+    if len(depth) and depth.min() < 0:
+        raise Exception("I have a FINISH event with no START event")
+
+    # At any one nesting level, STARTs and FINISHes alternate, so each
+    # START is matched by the next event at the same level.
+    level = np.where(is_start, depth, depth + 1)
+    order = np.argsort(level, kind='mergesort')
+    level = level[order]
+    start = is_start[order]
+    pairs = np.flatnonzero(start[:-1] & (level[:-1] == level[1:]))
+
+    by_finish = np.argsort(order[pairs + 1], kind='mergesort')
+    starts   = order[pairs][by_finish]
+    finishes = order[pairs + 1][by_finish]
+
+    if (events['step'][starts] != events['step'][finishes]).any():
+        raise Exception(
+            """I have a FINISH event for the START event of a
+            different step""")
+
+    procs = np.zeros(len(starts), dtype=proc_dtype)
+    procs['step']  = events['step'][finishes]
+    procs['start'] = events['time'][starts]
+    procs['stop']  = events['time'][finishes]
+    procs['job']   = events['job'][finishes]
+    procs['source'] = events['source'][finishes]
+
+    matched = np.zeros(len(events), dtype=bool)
+    matched[starts] = True
+    return (procs, events[is_start & ~matched])
+
+class TimingBuilder(object):
+
+    """Matches START events to FINISH events as they arrive.
+
+    Completed steps accumulate in procs. START events that haven't been
+    matched yet are kept in open, and in_progress() reports them as
+    steps that have been running until a given time.
+    """
+
+    def __init__(self):
+        self.open  = np.zeros(0, dtype=event_dtype)
+        self.procs = []
+
+    def add(self, events):
+
+        """Add an array of events. Returns the procs they complete."""
+
+        (procs, self.open) = match_events(concat_events([self.open, events]))
+        self.procs.append(procs)
+        return procs
+
+    def in_progress(self, now):
+        procs = np.zeros(len(self.open), dtype=proc_dtype)
+        procs['step']  = self.open['step']
+        procs['start'] = self.open['time']
+        procs['stop']  = now
+        procs['job']   = self.open['job']
+        procs['source'] = self.open['source']
+        return procs
+
+def build_timings(events):
+
+    """Given an array of events, match each START events to its
+corresponding FINISH event and return an array of the resulting
+procs."""
+
+    return match_events(events)[0]
+
+def append_filenames(dest, dirname, filenames):
+    for filename in filenames:
+        if log_file_pat.match(filename) or log_archive_pat.match(filename):
+            dest.append(dirname + "/" + filename)
+
+def parse_log_source(filename, job_name, scanner):
+
+    """Return the events in a file found by find_log_files, using the
+given entry in log_parsers. Log archives are always read with
+scan_log_archive."""
+
+    if log_archive_pat.match(os.path.basename(filename)):
+        return scan_log_archive(filename, job_name)
+    return log_parsers[scanner](filename, job_name)
+
+def find_log_files(path):
+    log_files = []
+    os.path.walk(path, append_filenames, log_files)
+    return log_files
+
+def load_events_for_job(path, job_name, scanner='cached', log_files=None):
+
+    """Return the events from all the log files for the job in path. If
+log_files is given, it is used instead of looking for them again."""
+
+    if log_files is None:
+        log_files = find_log_files(path)
+    return concat_events([parse_log_source(f, job_name, scanner)
+                          for f in log_files])
+
+def parse_log_file_in_worker(args):
+
+    """Worker entry point for parallel ingestion. Takes a (filename,
+job_name, scanner) tuple and returns the events from that file along
+with the worker's lists of step names and source names, which the
+step and source codes index, and the scan_counts for the file."""
+
+    (filename, job_name, scanner) = args
+    before = dict(scan_counts)
+    events = parse_log_source(filename, job_name, scanner)
+    counts = dict((k, scan_counts[k] - before[k]) for k in scan_counts)
+    return (events, step_names.strings, source_names.strings, counts)
+
+def parse_log_files(tasks, num_workers):
+
+    """Parse the files for a list of (filename, job_name, scanner) tasks
+using a pool of num_workers processes. Returns a list with one event
+array per task, in the same order as tasks, with codes that index our
+step_names, job_names, and source_names."""
+
+    # Only needed with more than one worker, so it isn't imported at
+    # startup
+    import multiprocessing
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        results = pool.map(parse_log_file_in_worker, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Each worker has its own Names, so translate its codes into ours
+    for ((filename, job_name, scanner), (events, steps, sources, counts)) in zip(
+        tasks, results):
+        events['step']   = step_names.codes(steps)[events['step']]
+        events['job']    = job_names.code(job_name)
+        events['source'] = source_names.codes(sources)[events['source']]
+        for k in counts:
+            scan_counts[k] += counts[k]
+
+    return [result[0] for result in results]
+
+def load_events_for_jobs(jobs, num_workers, scanner='cached',
+                         job_log_files=None):
+
+    """Parse the log files for all of the given (job_name, dir) pairs
+using a pool of num_workers processes. Returns a list with one event
+array per job, in the same order as jobs. The events for each job are
+in the same order load_events_for_job would produce them. If
+job_log_files is given, it holds the list of log files for each job."""
+
+    if job_log_files is None:
+        job_log_files = [find_log_files(dir) for (job_name, dir) in jobs]
+
+    tasks  = []
+    bounds = []
+    for ((job_name, dir), log_files) in zip(jobs, job_log_files):
+        bounds.append((len(tasks), len(tasks) + len(log_files)))
+        tasks.extend([(f, job_name, scanner) for f in log_files])
+
+    events = parse_log_files(tasks, num_workers)
+    return [concat_events(events[start:stop]) for (start, stop) in bounds]
+
+def infer_preproc_from_events(events):
+    log_starts = events[events['step'] == step_names.code('log')]
+    log_starts = log_starts[np.argsort(log_starts['time'], kind='mergesort')]
+    (start, stop) = log_starts[0:2]
+    return make_proc('Pre-processing', start['time'], stop['time'],
+                     start['job'], start['source'])
+
+def procs_from_events(events):
+
+    """Return the procs for the events from all the log files of one
+copy of a job, including pre-processing."""
+
+    return concat_events([infer_preproc_from_events(events),
+                          build_timings(events)], proc_dtype)
+
+def load_job_procs(jobs, scanner='cached', num_workers=1):
+
+    """Parse the logs for the given (job_name, dir) pairs and return a
+list of (job_name, dir, procs), which is what the pages and
+procs_to_array work from."""
+
+    if num_workers > 1:
+        job_events = load_events_for_jobs(jobs, num_workers, scanner)
+    else:
+        job_events = [load_events_for_job(dir, job_name, scanner)
+                      for (job_name, dir) in jobs]
+    return [(job_name, dir, procs_from_events(events))
+            for ((job_name, dir), events) in zip(jobs, job_events)]
+
+class JobWatcher(object):
+
+    """Follows the log files for one copy of a running job.
+
+    Each call to update() picks up any new log files and reads only
+    the lines that were appended to the known ones since the last call.
+    procs() returns the steps completed so far along with the steps
+    that are still running.
+    """
+
+    def __init__(self, job_name, path):
+        self.job_name   = job_name
+        self.path       = path
+        self.log_files  = []
+        self.scanners   = {}
+        self.builders   = {}
+        self.log_starts = np.zeros(0, dtype=event_dtype)
+
+    def update(self):
+        log = step_names.code('log')
+        for filename in find_log_files(self.path):
+            # Compressed and archived logs belong to finished jobs
+            if (is_compressed(filename) or
+                log_archive_pat.match(os.path.basename(filename))):
+                continue
+            if filename not in self.scanners:
+                self.log_files.append(filename)
+                self.scanners[filename] = LogScanner(filename, self.job_name)
+                self.builders[filename] = TimingBuilder()
+
+            events = self.scanners[filename].scan(final=False)
+            is_log = events['step'] == log
+            self.log_starts = concat_events([self.log_starts, events[is_log]])
+            self.builders[filename].add(events[~is_log])
+
+    def preproc(self, now):
+
+        """Return the pre-processing proc, which runs until the second
+log file starts, or until now if there is only one log so far."""
+
+        if not len(self.log_starts):
+            return None
+        log_starts = self.log_starts[
+            np.argsort(self.log_starts['time'], kind='mergesort')]
+        start = log_starts[0]
+        stop  = log_starts[1]['time'] if len(log_starts) > 1 else now
+        return make_proc('Pre-processing', start['time'], stop,
+                         start['job'], start['source'])
+
+    def procs(self, now):
+        preproc = self.preproc(now)
+        procs = [] if preproc is None else [preproc]
+        for filename in self.log_files:
+            builder = self.builders[filename]
+            procs.extend(builder.procs)
+            procs.append(builder.in_progress(now))
+        return concat_events(procs, proc_dtype)
@@ -0,0 +1,890 @@
+"""Rendering: the HTML pages of the report and the exports of the
+final table, written to output_dir, along with the assets the pages
+use.
+
+lxml is only needed for writing pages, so it is imported the first time
+a page is built, which keeps it out of the startup time of commands
+that don't write any.
+"""
+
+import cgi
+import csv
+import importlib
+import json
+import numpy as np
+import os
+import resource
+import shutil
+import sys
+import time
+import zipfile
+
+from contextlib import contextmanager
+
+from rumprof.parse import step_names, source_names
+from rumprof.aggregate import (
+    seconds_per_hour, stat_percentiles, renamed_step_codes,
+    first_seen_steps, chunk_times, step_stats, find_stragglers,
+    concurrency_curve, step_parallelism, chunk_idle_times,
+    replay_schedule, critical_path, merge_speedups, job_span,
+    what_if_table, make_final_table, final_table_jobs, missing_steps)
+
+class LazyModule(object):
+
+    """Stands in for a module that is slow to import, importing it the
+    first time one of its attributes is used."""
+
+    def __init__(self, name):
+        self.name   = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+E         = LazyModule('lxml.html.builder')
+lxml_html = LazyModule('lxml.html')
+
+def TR(*children, **attrib):
+    return E.TR(*children, **attrib)
+
+def TD(*children, **attrib):
+    return E.TD(*children, **attrib)
+
+def TH(*children, **attrib):
+    return E.TH(*children, **attrib)
+
+output_dir = 'rum_profile'
+
+class SelfProfile(object):
+
+    """Records the cost of each stage of a run for --self-profile.
+
+    Each stage gets its wall clock time, the CPU time used by this
+    process and by finished worker processes, and the peak resident
+    memory of this process at the end of the stage. counts holds
+    totals such as the number of lines scanned.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.counts = {}
+        self.start  = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.time()
+        cpu  = os.times()
+        yield
+        after = os.times()
+        self.stages.append({
+                'stage'         : name,
+                'seconds'       : time.time() - wall,
+                'cpu_seconds'   : max(0.0, after[0] + after[1] - cpu[0] - cpu[1]),
+                'child_seconds' : max(0.0, after[2] + after[3] - cpu[2] - cpu[3]),
+                'peak_rss_mb'   : peak_rss_mb()})
+
+    def to_json(self):
+        return {'stages'  : self.stages,
+                'counts'  : self.counts,
+                'seconds' : time.time() - self.start}
+
+def peak_rss_mb():
+
+    """Return the peak resident memory of this process in megabytes.
+(Python 2 has no tracemalloc, so this is the closest we get.)"""
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+def write_pages(tables, job_procs, straggler_factor, profile=None,
+                what_if=(), speedup=2.0):
+
+    """Write every page of the report, given the merged (job_name,
+table) pairs from merge_job_stats and the (job_name, dir, procs) for
+each copy of each job. what_if and speedup are passed on to
+print_critical_path_page. Each page is timed as a stage of profile, if
+given. Returns the final table."""
+
+    if profile is None:
+        profile = SelfProfile()
+
+    with profile.stage('install_assets'):
+        install_assets()
+    with profile.stage('make_final_table'):
+        table = make_final_table(tables)
+    with profile.stage('print_tables'):
+        print_tables(table, [x[0] for x in tables], ['cpu', 'wc'])
+    with profile.stage('print_stats_page'):
+        print_stats_page(job_procs, straggler_factor)
+    with profile.stage('print_timeline_page'):
+        print_timeline_page(job_procs)
+    with profile.stage('print_critical_path_page'):
+        print_critical_path_page(job_procs, what_if, speedup)
+    with profile.stage('print_help_page'):
+        print_help_page()
+    return table
+
+# Directory holding bootstrap.zip and asset_files, which are part of
+# the package
+assets_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Files install_assets copies into output_dir besides the contents of
+# bootstrap.zip
+asset_files = ['profile.css']
+
+def out_of_date(target, mtime, size):
+    try:
+        st = os.stat(target)
+    except OSError:
+        return True
+    return st.st_mtime < mtime or st.st_size != size
+
+def install_assets():
+
+    """Extract bootstrap.zip and copy asset_files from assets_dir into
+output_dir, skipping any file that is already there, at least as new as
+the source, and the same size."""
+
+    if not os.path.isdir(output_dir):
+        os.mkdir(output_dir)
+
+    bootstrap = os.path.join(assets_dir, 'bootstrap.zip')
+    mtime = os.path.getmtime(bootstrap)
+    with zipfile.ZipFile(bootstrap) as archive:
+        for member in archive.infolist():
+            target = os.path.join(output_dir, member.filename)
+            if member.filename.endswith('/'):
+                continue
+            if out_of_date(target, mtime, member.file_size):
+                archive.extract(member, output_dir)
+
+    for filename in asset_files:
+        source = os.path.join(assets_dir, filename)
+        target = os.path.join(output_dir, filename)
+        if out_of_date(target, os.path.getmtime(source),
+                       os.path.getsize(source)):
+            shutil.copyfile(source, target)
+
+def write_report(tables):
+
+    table = make_final_table(tables)
+    print_tables(table, [x[0] for x in tables], ['cpu', 'wc'])
+
+def print_help_page(nav_query=''):
+    with open(os.path.join(output_dir, 'help.html'), 'w') as f:
+        contents = E.DIV(
+            E.P("""
+This shows the amount of time spent on each step for one or more RUM
+jobs. You should be able to use the output to gain some insight into
+the performance of a single job, or to compare the running times for
+two or more jobs in order to understand the effects of changes made to
+the RUM code, to the input data, or to the system on which RUM was
+run."""),
+
+            E.P("""
+The times for a single job are are compiled by parsing the log files
+after the job is finished. For each step, we consider the duration to
+be from the time the script was actually invoked to the time the
+script exited. This means that any latency caused by the cluster's
+scheduling system will not be reflected in the times."""),
+
+            E.P("""
+"CPU time" for a step measures the total time for the step across all
+chunks. If you have grouped multiple jobs together, the CPU time
+reported here is the median value for all the jobs. This is intended
+to show the total amount of computing time the job would take for a
+typical invocation. The total CPU time for the job is the sum of all
+these median values.
+"""),
+
+            E.P("""
+"Wallclock time" for a step is the time of the chunk that took the
+longest time to complete the step. We use the maximum value in order
+model the worst-case scenario, where one of the chunks takes much
+longer than the other chunks, and becomes the limiting factor for the
+running time of the whole job. If you have grouped jobs together,
+wallclock time is the median value for all jobs. This is intended to
+show the maximum duration of a typical invocation of the job."""),
+
+            E.P("""
+The times for all steps are highlighted in varying shades of yelloq in
+order to indicate each step's impact on the total running time,
+relative to the other steps. The step with the longest time is pure
+yellow, the step with the shortest time is pure white, and the colors
+for the other steps are scaled linearly according to the running
+time. This is intended to allow you to quickly identify hot spots, or
+steps that took a very long time compared to other steps, and which
+might benefit from optimization or parameter tuning.
+"""),
+
+            E.P("""
+If you have run two or more job groups, we use the first group as a
+baseline and compare the running time of all the other jobs to the
+baseline. The "improvement" for a step shows the number of hours saved
+relative to the baseline. The percent improvement is the improvement
+divided by the total running time for the baseline job. This is
+intended to show the impact that improving the running time of one
+step has on the running time of the entire job. For example suppose
+the baseline job took 100 hours, 30 of which were spent on the "Run
+BLAT" step, and that the "Run BLAT" step in the comparison job took
+only 20 hours. The improvement is 30 - 20 = 10 hours, and the percent
+improvement is (30 - 20) / 100 = 10%.  If a step in the new job is
+slower, the improvement and percent improvement will be negative."""),
+
+            E.P("""
+The improvement for each step is colored green or red according to the
+degree to which that step improved or degraded the performance
+compared to the baseline."""),
+
+            E.P("""
+The chunk times page shows, for each copy of each job, how the time
+spent on each step was spread over the chunks: the fastest and slowest
+chunk, the median, and the 90th, 95th and 99th percentiles. The ratio
+of the slowest chunk to the median shows whether the wallclock time
+for a step is driven by one straggler or whether all chunks are slow.
+Chunks that took much longer than the median are listed by log file,
+which makes it easier to track down a bad node."""),
+
+            E.P("""
+The concurrency page shows, for each copy of each job, how many steps
+were running at once over the life of the job. For each step it shows
+the most chunks that were running the step at the same time, and the
+average number, which is the total time spent in the step divided by
+the time from the first chunk starting the step to the last chunk
+finishing it. It also shows, for each chunk, how much time passed
+between one step finishing and the next one starting. A step whose
+average is much lower than the number of chunks spent a long time
+waiting for a few slow chunks, and idle time within a chunk usually
+points at the scheduler."""),
+
+            E.P("""
+The critical path page shows, for each copy of each job, the chain of
+steps that decided when the job finished: pre-processing, then the
+steps of the chunk that finished last, then post-processing. Making a
+step faster only shortens the job if the step is on this path. The
+steps in each log file are taken to run one after another, and the
+first step in a log file to wait for every step in the other logs that
+had finished before it started. The page also replays the job with
+some steps running faster, keeping the gaps between steps as they
+were, to project how much wallclock and CPU time would be saved. By
+default each step is tried on its own at twice the speed; use
+--speedup to change that, and --what-if STEP=X to try particular
+steps."""),
+
+
+            E.P(E.STRONG("Note:"),
+                """
+These numbers do not include the "preprocessing" phase at all. Prior
+to RUM 2.0.3, it is difficult to determine from the log files exactly
+when pre-processing begins and ends. RUM 2.0.3 and greater will
+clearly include these times in the log file, so future versions of the
+profiling program will be able to incorporate times for
+preprocessing.""")
+            )
+
+        help_page = template('help',
+                             contents, nav_query)
+        f.write(lxml_html.tostring(help_page))
+
+
+# Formats write_exports can write the final table in
+export_formats = ['json', 'csv', 'npz']
+
+def write_exports(table, formats):
+
+    """Write the final table to final_table.<format> in output_dir for
+each of the given formats. Times are in seconds. The highlight
+intensities are left out, since they only matter for the HTML.
+
+The JSON file has the baseline job, the list of jobs, and a list of
+rows, each mapping column names to values, with null for NaN. The CSV
+file has a header line with the column names. The .npz file has the
+table as a structured array called 'table' and the job names as
+'jobs'."""
+
+    jobs = final_table_jobs(table)
+    columns = [c for c in table.dtype.names if not c.endswith('_intensity')]
+    exported = np.zeros(len(table), dtype=[(c, table.dtype[c])
+                                           for c in columns])
+    for c in columns:
+        exported[c] = table[c]
+
+    if 'json' in formats:
+        rows = []
+        for row in exported.tolist():
+            rows.append(dict(
+                    (c, None if isinstance(v, float) and np.isnan(v) else v)
+                    for (c, v) in zip(columns, row)))
+        with open(os.path.join(output_dir, 'final_table.json'), 'w') as out:
+            json.dump({'baseline' : jobs[0],
+                       'jobs'     : jobs,
+                       'columns'  : columns,
+                       'rows'     : rows}, out, indent=2, sort_keys=True)
+
+    if 'csv' in formats:
+        with open(os.path.join(output_dir, 'final_table.csv'), 'wb') as out:
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            writer.writerows(exported.tolist())
+
+    if 'npz' in formats:
+        np.savez_compressed(os.path.join(output_dir, 'final_table.npz'),
+                            table=exported, jobs=np.array(jobs))
+
+def td_hours(seconds, bgcolor=None):
+    if bgcolor is None:
+        return TD('%.2f' % (seconds / seconds_per_hour),
+                  CLASS='numeric')
+    else:
+        return TD('%.2f' % (seconds / seconds_per_hour),
+                  CLASS='numeric',
+                  bgcolor=bgcolor)
+
+def td_percent(pct, bgcolor=None):
+    if bgcolor is None:
+        return TD('%.2f%%' % pct,
+                  CLASS='numeric')
+    else:
+        return TD('%.2f%%' % pct, bgcolor=bgcolor,
+                  CLASS='numeric')
+
+metric_names = {
+    'wc' : 'Wallclock',
+    'cpu' : 'CPU'
+}
+
+def gain_pct_to_bgcolor(pct):
+    intensity = 255 * (pct / 100.)
+    if (intensity < 0):
+        intensity = 255 + intensity
+        return '#ff%02x%02x' % (intensity, intensity)
+    else:
+        intensity = 255 - intensity
+        return '#%02xff%02x' % (intensity, intensity)
+        
+
+# Pages in the navigation bar, as (name, title) pairs. Each page is
+# written to <name>.html in output_dir.
+pages = [
+    ('cpu',      'CPU time'),
+    ('wc',       'Wallclock time'),
+    ('stats',    'Chunk times'),
+    ('timeline', 'Concurrency'),
+    ('critical', 'Critical path'),
+    ('help',     'Help'),
+]
+
+def template(name, contents, nav_query=''):
+
+    """Return the page called name with the given contents. nav_query
+is a query string added to the links in the navigation bar, so that
+pages served by --serve keep the jobs that were chosen."""
+
+    nav = [E.LI(E.A(title, href='%s.html%s' % (page, nav_query)),
+                CLASS='active' if name == page else '')
+           for (page, title) in pages]
+
+    return E.HTML(
+        E.HEAD(
+            E.LINK(rel='stylesheet', type='text/css', href='bootstrap/css/bootstrap.css'),
+            E.LINK(rel='stylesheet', type='text/css', href='profile.css'),
+            E.SCRIPT(src='bootstrap/js/bootstrap.min.js'),
+            E.TITLE('RUM Job Profile')),
+
+        E.BODY(
+
+            E.DIV(
+                E.DIV(
+                    E.DIV(
+                        E.A(E.SPAN(CLASS='icon-bar'),
+                            E.SPAN(CLASS='icon-bar'),
+                            E.SPAN(CLASS='icon-bar'),
+                            CLASS='btn btn-navbar'),
+                        E.A('RUM Profile', CLASS='brand', href='#'),
+                        E.DIV(
+                            E.UL(*nav, CLASS='nav'),
+                            CLASS='nav-collapse collapse'),
+                        CLASS='container'),
+                    CLASS='navbar-inner'),
+                CLASS='navbar navbar-inverse navbar-fixed-top'),
+            E.BR(),
+            E.BR(),
+            E.BR(),
+            E.DIV(contents,
+                  CLASS='container')))
+    
+
+# Stands in for the data rows in the page print_tables renders with
+# template, so the rows can be streamed in between the two halves
+table_rows_marker = '<tr><td>table rows</td></tr>'
+
+def numeric_cell(text, bgcolor=None):
+
+    """Return the HTML td_hours or td_percent would produce for a cell
+containing text, without building an element."""
+
+    if bgcolor is None:
+        return '<td CLASS="numeric">%s</td>' % text
+    return '<td bgcolor="%s" CLASS="numeric">%s</td>' % (bgcolor, text)
+
+def table_page_parts(table, job_names, metric, nav_query=''):
+
+    """Return the HTML for the page of the given metric that comes
+before the data rows and the HTML that comes after them."""
+
+    baseline = job_names[0]
+
+    top_headers = TR(TH(''))
+    headers    =  TR(TH('Steps'))
+
+    # Build the header row
+    for j in job_names:
+
+        colspan = 1
+
+        headers.append(TH('chunks'))
+        colspan += 2
+        headers.append(TH('hours', colspan='2'))
+
+        # All jobs except the baseline get "hours gained" and
+        # "percent hours gained" columns
+        if j != baseline:
+            colspan += 2
+            headers.append(TH('improvement', colspan='2'))
+
+        top_headers.append(TH(j, colspan=str(colspan)))
+
+    summary = [TD('Totals')]
+    for j in job_names:
+        summary.append(TD(''))
+        summary.extend([
+                td_hours(sum(table['%s_%s' % (j, metric)])),
+                td_percent(sum(table['%s_%s_pct' % (j, metric)]))])
+
+        if j != baseline:
+            hours   = sum(table['%s_%s_gain' % (j, metric)])
+            pct     = sum(table['%s_%s_pct_gain' % (j, metric)])
+            bgcolor = gain_pct_to_bgcolor(pct)
+            summary.extend([
+                    td_hours(hours, bgcolor),
+                    td_percent(pct, bgcolor)])
+
+    html = template(metric, E.DIV(
+            E.TABLE(top_headers, headers,
+                    TR(TD('table rows')),
+                    TR(*summary))), nav_query)
+
+    return lxml_html.tostring(html).split(table_rows_marker)
+
+def table_row_cells(row, job_names, metric):
+
+    """Return the HTML cells for metric in one row of the final table,
+not including the step name."""
+
+    baseline = job_names[0]
+    cells = []
+
+    for j in job_names:
+
+        cells.append('<td CLASS="numeric">%d</td>' % row['%s_chunks' % j])
+
+        bgcolor = '#ffff%02x' % row['%s_%s_intensity' % (j, metric)]
+        cells.append(numeric_cell(
+                '%.2f' % (row['%s_%s' % (j, metric)] / seconds_per_hour),
+                bgcolor))
+        cells.append(numeric_cell(
+                '%.2f%%' % row['%s_%s_pct' % (j, metric)], bgcolor))
+
+        if j != baseline:
+            hours = row['%s_%s_gain' % (j, metric)]
+            pct   = row['%s_%s_pct_gain' % (j, metric)]
+
+            bgcolor = gain_pct_to_bgcolor(pct)
+            cells.append(numeric_cell(
+                    '%.2f' % (hours / seconds_per_hour), bgcolor))
+            cells.append(numeric_cell('%.2f%%' % pct, bgcolor))
+
+    return ''.join(cells)
+
+def print_tables(table, job_names, metrics, nav_query=''):
+
+    """Write the <metric>.html page for each of the given metrics from
+the final table, in a single pass over its rows. Each row is written
+as soon as it is formatted, rather than building a tree for the whole
+page."""
+
+    outs  = [open(os.path.join(output_dir, '%s.html' % metric), 'w')
+             for metric in metrics]
+    parts = [table_page_parts(table, job_names, metric, nav_query)
+             for metric in metrics]
+    try:
+        for (out, (head, tail)) in zip(outs, parts):
+            out.write(head)
+
+        for row in table:
+            step = '<tr><td>%s</td>' % cgi.escape(row['step'])
+            for (out, metric) in zip(outs, metrics):
+                out.write(step)
+                out.write(table_row_cells(row, job_names, metric))
+                out.write('</tr>')
+
+        for (out, (head, tail)) in zip(outs, parts):
+            out.write(tail)
+    finally:
+        for out in outs:
+            out.close()
+
+def td_ratio(ratio):
+    if np.isnan(ratio):
+        return TD('-', CLASS='numeric')
+    return TD('%.2f' % ratio, CLASS='numeric')
+
+def step_stats_table(stats):
+
+    """Return a table element showing the rows of a step_stats table."""
+
+    headers = TR(TH('Step'), TH('chunks'), TH('total'), TH('min'))
+    for (name, pct) in stat_percentiles:
+        headers.append(TH(name))
+    headers.extend([TH('max'), TH('max / median')])
+
+    stat_rows = [headers]
+    for row in stats:
+        tr = TR(TD(step_names.strings[row['step']]),
+                TD(str(row['count']), CLASS='numeric'),
+                td_hours(row['sum']),
+                td_hours(row['min']))
+        for (name, pct) in stat_percentiles:
+            tr.append(td_hours(row[name]))
+        tr.extend([td_hours(row['max']), td_ratio(row['straggler'])])
+        stat_rows.append(tr)
+
+    return E.TABLE(*stat_rows)
+
+def print_stats_page(job_procs, straggler_factor, nav_query=''):
+
+    """Write the chunk times page, showing for each (job_name, dir,
+procs) the distribution of the time each chunk spent on each step, and
+the chunks that were more than straggler_factor times slower than the
+median for a step."""
+
+    sections = []
+
+    for (job_name, path, procs) in job_procs:
+
+        times_for_step = chunk_times(procs)
+        stats = step_stats(times_for_step)
+        stats = stats[np.searchsorted(stats['step'], first_seen_steps(procs))]
+
+        straggler_rows = [TR(TH('Step'), TH('Log file'), TH('hours'),
+                             TH('x median'))]
+        for row in find_stragglers(times_for_step, straggler_factor):
+            source = row['source']
+            straggler_rows.append(TR(
+                    TD(step_names.strings[row['step']]),
+                    TD(os.path.basename(source_names.strings[source])
+                       if source >= 0 else 'unknown'),
+                    td_hours(row['time']),
+                    td_ratio(row['ratio'])))
+
+        sections.extend([
+                E.H3('%s (%s)' % (job_name, path)),
+                E.H4('Hours per chunk'),
+                step_stats_table(stats),
+                E.H4('Chunks taking more than %g times the median' %
+                     straggler_factor)])
+        if len(straggler_rows) > 1:
+            sections.append(E.TABLE(*straggler_rows))
+        else:
+            sections.append(E.P('None'))
+
+    with open(os.path.join(output_dir, 'stats.html'), 'w') as out:
+        html = template('stats', E.DIV(*sections), nav_query)
+        out.write(lxml_html.tostring(html))
+
+# Size of the concurrency chart on the timeline page, in pixels
+chart_width  = 800
+chart_height = 120
+
+def concurrency_chart(procs):
+
+    """Return an SVG element plotting the number of procs running over
+time. Each pixel column shows the most procs running at any time
+during the interval it covers."""
+
+    (times, counts) = concurrency_curve(procs)
+    (t0, t1) = (times[0], times[-1])
+    peak = max(counts.max(), 1)
+
+    edges = np.linspace(t0, t1, chart_width + 1)[:-1]
+    at_edge = np.searchsorted(times, edges, side='right') - 1
+    column  = counts[np.maximum(at_edge, 0)]
+    inside  = ((times - t0) * chart_width // max(t1 - t0, 1)).clip(
+        0, chart_width - 1)
+    np.maximum.at(column, inside, counts)
+
+    x = np.repeat(np.arange(chart_width + 1), 2)[1:-1]
+    y = chart_height - np.repeat(column, 2) * chart_height / float(peak)
+    points = ' '.join('%d,%.1f' % p for p in zip(x, y))
+
+    return E.DIV(
+        E.E.svg(E.E.polyline(points=points, fill='none', stroke='#08c'),
+                width=str(chart_width), height=str(chart_height)),
+        E.P('Peak of %d steps running at once over %.2f hours' % (
+                counts.max(), (t1 - t0) / seconds_per_hour)))
+
+def print_timeline_page(job_procs, nav_query=''):
+
+    """Write the timeline page, showing for each (job_name, dir, procs)
+how many steps were running over time, how parallel each step was,
+and how long each chunk sat idle between steps."""
+
+    sections = []
+
+    for (job_name, path, procs) in job_procs:
+
+        step_rows = [TR(TH('Step'), TH('runs'), TH('busy hours'),
+                        TH('span hours'), TH('peak'), TH('average'))]
+        for row in step_parallelism(procs):
+            step_rows.append(TR(
+                    TD(str(row['step'])),
+                    TD(str(row['procs']), CLASS='numeric'),
+                    td_hours(row['busy']),
+                    td_hours(row['span']),
+                    TD(str(row['peak']), CLASS='numeric'),
+                    TD('%.2f' % row['average'], CLASS='numeric')))
+
+        chunk_rows = [TR(TH('Log file'), TH('span hours'),
+                         TH('busy hours'), TH('idle hours'))]
+        idle = chunk_idle_times(procs)
+        for row in idle:
+            chunk_rows.append(TR(
+                    TD(os.path.basename(row['source'])),
+                    td_hours(row['span']),
+                    td_hours(row['busy']),
+                    td_hours(row['idle'])))
+        chunk_rows.append(TR(
+                TD('Totals'),
+                td_hours(idle['span'].sum()),
+                td_hours(idle['busy'].sum()),
+                td_hours(idle['idle'].sum())))
+
+        sections.extend([
+                E.H3('%s (%s)' % (job_name, path)),
+                concurrency_chart(procs),
+                E.H4('Parallelism by step'),
+                E.TABLE(*step_rows),
+                E.H4('Idle time by chunk'),
+                E.TABLE(*chunk_rows)])
+
+    with open(os.path.join(output_dir, 'timeline.html'), 'w') as out:
+        html = template('timeline', E.DIV(*sections), nav_query)
+        out.write(lxml_html.tostring(html))
+
+def speedup_label(speedups):
+    return ', '.join('%s %gx faster' % (step, factor)
+                     for (step, factor) in speedups)
+
+def print_critical_path_page(job_procs, what_if=(), speedup=2.0,
+                             nav_query=''):
+
+    """Write the critical path page, showing for each (job_name, dir,
+procs) the chain of steps that bounded its wallclock time, and the
+projected wallclock and CPU time if steps ran faster: each of the
+(step, factor) pairs in what_if that is in the job, then all of those
+together if there are more than one, and then each step on its own
+running speedup times faster. what_if is merged with merge_speedups
+first."""
+
+    sections = []
+    what_if = merge_speedups(what_if)
+
+    for (job_name, path, procs) in job_procs:
+
+        schedule = replay_schedule(procs)
+        wallclock = job_span(schedule)
+        cpu = float((procs['stop'] - procs['start']).sum())
+        steps = renamed_step_codes()[procs['step'][schedule.order]]
+        durations = schedule.stop - schedule.start
+        sources = procs['source'][schedule.order]
+
+        chain_rows = [TR(TH('Log file'), TH('steps'), TH('first step'),
+                         TH('last step'), TH('hours waiting'), TH('hours'))]
+        on_path = []
+        ready = schedule.start.min()
+        for (first, last) in critical_path(schedule):
+            chain_rows.append(TR(
+                    TD(os.path.basename(source_names.strings[sources[first]])),
+                    TD(str(last - first), CLASS='numeric'),
+                    TD(step_names.strings[steps[first]]),
+                    TD(step_names.strings[steps[last - 1]]),
+                    td_hours(schedule.start[first] - ready),
+                    td_hours(schedule.stop[last - 1] - schedule.start[first])))
+            ready = schedule.stop[last - 1]
+            on_path.append(np.arange(first, last))
+        on_path = np.concatenate(on_path)
+
+        step_time = np.bincount(steps[on_path], weights=durations[on_path],
+                                minlength=len(step_names.strings))
+        step_rows = [TR(TH('Step'), TH('hours'), TH('% of wallclock'))]
+        for code in first_seen_steps(procs):
+            if step_time[code] > 0:
+                step_rows.append(TR(
+                        TD(step_names.strings[code]),
+                        td_hours(step_time[code]),
+                        td_percent(100 * step_time[code] / wallclock)))
+        step_rows.append(TR(
+                TD('Waiting between steps'),
+                td_hours(wallclock - step_time.sum()),
+                td_percent(100 * (wallclock - step_time.sum()) / wallclock)))
+
+        missing = missing_steps([step for (step, factor) in what_if],
+                                [procs])
+        job_what_if = [(step, factor) for (step, factor) in what_if
+                       if step not in missing]
+        scenarios = [(speedup_label([s]), [s]) for s in job_what_if]
+        if len(job_what_if) > 1:
+            scenarios.append((speedup_label(job_what_if), job_what_if))
+        scenarios.extend(
+            [(speedup_label([(step, speedup)]), [(step, speedup)])
+             for step in step_names.lookup(first_seen_steps(procs))])
+
+        what_if_rows = [TR(TH('Change'), TH('wallclock hours'),
+                           TH('saved', colspan='2'), TH('CPU hours'),
+                           TH('saved', colspan='2'))]
+        for row in what_if_table(procs, scenarios):
+            wc_saved  = wallclock - row['wallclock']
+            cpu_saved = cpu - row['cpu']
+            wc_pct    = 100 * wc_saved / wallclock
+            cpu_pct   = 100 * cpu_saved / cpu
+            what_if_rows.append(TR(
+                    TD(row['label']),
+                    td_hours(row['wallclock']),
+                    td_hours(wc_saved, gain_pct_to_bgcolor(wc_pct)),
+                    td_percent(wc_pct, gain_pct_to_bgcolor(wc_pct)),
+                    td_hours(row['cpu']),
+                    td_hours(cpu_saved, gain_pct_to_bgcolor(cpu_pct)),
+                    td_percent(cpu_pct, gain_pct_to_bgcolor(cpu_pct))))
+
+        sections.extend([
+                E.H3('%s (%s)' % (job_name, path)),
+                E.P('%.2f hours wallclock and %.2f hours CPU time' % (
+                        wallclock / seconds_per_hour, cpu / seconds_per_hour)),
+                E.H4('Critical path'),
+                E.TABLE(*chain_rows),
+                E.H4('Time on the critical path by step'),
+                E.TABLE(*step_rows),
+                E.H4('What if'),
+                E.TABLE(*what_if_rows)])
+
+    for step in missing_steps([step for (step, factor) in what_if],
+                              [procs for (job_name, path, procs) in job_procs]):
+        print "Step %s isn't in any of the jobs" % step
+
+    with open(os.path.join(output_dir, 'critical.html'), 'w') as out:
+        html = template('critical', E.DIV(*sections), nav_query)
+        out.write(lxml_html.tostring(html))
+
+def print_stream_pages(streaming):
+
+    """Write the chunk times, timeline and critical path pages for the
+StreamingJobs
+from a --stream run. Percentiles come from each step's QuantileSketch.
+Neither stragglers nor concurrency can be found without keeping every
+step's times, so those are left out."""
+
+    sections = []
+    for job in streaming:
+        sections.extend([
+                E.H3('%s (%s)' % (job.job_name, job.path)),
+                E.H4('Hours per chunk'),
+                step_stats_table(job.step_stats())])
+    sections.append(E.P("""Stragglers aren't listed with --stream, which
+doesn't keep the time of each chunk."""))
+
+    with open(os.path.join(output_dir, 'stats.html'), 'w') as out:
+        html = template('stats', E.DIV(*sections))
+        out.write(lxml_html.tostring(html))
+
+    with open(os.path.join(output_dir, 'timeline.html'), 'w') as out:
+        html = template('timeline', E.DIV(E.P(
+                    """Concurrency isn't shown with --stream, which
+doesn't keep the start and stop times of each step.""")))
+        out.write(lxml_html.tostring(html))
+
+    with open(os.path.join(output_dir, 'critical.html'), 'w') as out:
+        html = template('critical', E.DIV(E.P(
+                    """The critical path isn't shown with --stream,
+which doesn't keep the start and stop times of each step.""")))
+        out.write(lxml_html.tostring(html))
+
+# The stage whose time each count from --self-profile is divided by to
+# get a rate
+count_stages = {
+    'lines'      : 'parse_logs',
+    'bytes'      : 'parse_logs',
+    'timestamps' : 'parse_logs',
+    'log_files'  : 'parse_logs',
+    'events'     : 'build_timings',
+    'procs'      : 'procs_to_array',
+}
+
+# With --stream, logs are read, matched into procs and summarized all in
+# one stage, so every count that has a stage is divided by its time
+stream_stage = 'stream_logs'
+
+def print_self_profile(profile):
+
+    """Write the results of a SelfProfile to self_profile.json and a
+summary page, self_profile.html, in output_dir."""
+
+    results = profile.to_json()
+    with open(os.path.join(output_dir, 'self_profile.json'), 'w') as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+    total = results['seconds']
+    seconds = dict((s['stage'], s['seconds']) for s in profile.stages)
+
+    stage_rows = [TR(TH('Stage'), TH('seconds'), TH('% of run'),
+                     TH('CPU seconds'), TH('worker CPU seconds'),
+                     TH('peak MB'))]
+    for s in profile.stages:
+        stage_rows.append(TR(
+                TD(s['stage']),
+                TD('%.3f' % s['seconds'], CLASS='numeric'),
+                TD('%.1f%%' % (100 * s['seconds'] / total), CLASS='numeric'),
+                TD('%.3f' % s['cpu_seconds'], CLASS='numeric'),
+                TD('%.3f' % s['child_seconds'], CLASS='numeric'),
+                TD('%.1f' % s['peak_rss_mb'], CLASS='numeric')))
+    stage_rows.append(TR(TD('Total'),
+                         TD('%.3f' % total, CLASS='numeric')))
+
+    count_rows = [TR(TH('Count'), TH('total'), TH('per second'))]
+    for name in sorted(profile.counts):
+        value = profile.counts[name]
+        stage = count_stages.get(name)
+        if stage is not None and stage not in seconds:
+            stage = stream_stage
+        elapsed = seconds.get(stage)
+        count_rows.append(TR(
+                TD(name),
+                TD(('%.3f' if isinstance(value, float) else '%d') % value,
+                   CLASS='numeric'),
+                TD('%d' % (value / elapsed) if elapsed else '',
+                   CLASS='numeric')))
+
+    with open(os.path.join(output_dir, 'self_profile.html'), 'w') as out:
+        html = template('self_profile', E.DIV(
+                E.H3('Time by stage'),
+                E.TABLE(*stage_rows),
+                E.H3('Work done'),
+                E.P("""Rates are per second of the stage that did the
+work. strptime_seconds is the part of parse_logs spent converting
+timestamps, summed over all worker processes."""),
+                E.TABLE(*count_rows)))
+        out.write(lxml_html.tostring(html))